@@ -0,0 +1,100 @@
+'''
+So sánh backend embedding torch (fp32) với onnx (int8):
+- cosine drift giữa vector onnx và vector torch trên cùng chunk
+- recall@k: top-k của câu hỏi embed bằng onnx so với torch, trên index hiện có (build bằng torch)
+  và trên index build lại toàn bộ bằng onnx
+- latency embed 1 câu hỏi, p50/p99
+
+    python benchmarks/embedding_backends.py --limit 2000 --k 10
+    python benchmarks/embedding_backends.py --query-file data/queries.txt --fp32
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.embeddings.backends import TorchEmbedder, OnnxEmbedder
+from src.embeddings.vn_embedder import get_embedding
+from src.database.chunk_store import load_chunks
+from src.utils.config import INDEX_FILE, CHUNK_FILE, EMBEDDING_MODEL_NAME
+
+def load_queries(query_file, texts, n_queries, seed=0):
+    if query_file:
+        with open(query_file, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    # không có câu hỏi thật -> lấy ~20 từ đầu của chunk ngẫu nhiên làm câu hỏi
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(texts), size=min(n_queries, len(texts)), replace=False)
+    return [' '.join(texts[i].split()[:20]) for i in idx]
+
+def query_latency(embedder, queries):
+    embedder.encode(queries[:1], batch_size=1, max_length=512)    # warmup
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        embedder.encode([q], batch_size=1, max_length=512)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def recall_at_k(approx_ids, exact_ids, k):
+    return float(np.mean([len(set(a[:k]) & set(e[:k])) / k for a, e in zip(approx_ids, exact_ids)]))
+
+def flat_index(vectors):
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=0, help='chỉ dùng N chunk đầu (0 = tất cả)')
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--query-file', default=None)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--fp32', action='store_true', help='so với onnx fp32 thay vì int8')
+    args = parser.parse_args()
+
+    chunks, _ = load_chunks(CHUNK_FILE)
+    texts = [text for text in (get_embedding(chunk) for chunk in chunks) if text]
+    if args.limit:
+        texts = texts[:args.limit]
+    queries = load_queries(args.query_file, texts, args.queries)
+    print(f"{len(texts)} chunk, {len(queries)} câu hỏi, k={args.k}")
+
+    torch_model = TorchEmbedder(EMBEDDING_MODEL_NAME)
+    onnx_model = OnnxEmbedder(EMBEDDING_MODEL_NAME, quantize=not args.fp32)
+    label = 'onnx fp32' if args.fp32 else 'onnx int8'
+
+    start = time.perf_counter()
+    torch_corpus = torch_model.encode(texts, batch_size=args.batch_size, show_progress=True)
+    torch_build = time.perf_counter() - start
+    start = time.perf_counter()
+    onnx_corpus = onnx_model.encode(texts, batch_size=args.batch_size, show_progress=True)
+    onnx_build = time.perf_counter() - start
+
+    drift = 1.0 - np.sum(torch_corpus * onnx_corpus, axis=1)
+    print(f"\nCosine drift ({label} vs torch): mean {drift.mean():.5f}, p99 {np.percentile(drift, 99):.5f}, max {drift.max():.5f}")
+    print(f"Embed corpus: torch {torch_build:.1f}s, {label} {onnx_build:.1f}s")
+
+    torch_queries = torch_model.encode(queries, batch_size=args.batch_size, max_length=512)
+    onnx_queries = onnx_model.encode(queries, batch_size=args.batch_size, max_length=512)
+
+    # index đang dùng (build bằng torch) nếu có, không thì index Flat từ vector torch vừa tính
+    index = faiss.read_index(INDEX_FILE) if os.path.exists(INDEX_FILE) and not args.limit else flat_index(torch_corpus)
+    _, exact = index.search(torch_queries, args.k)
+    _, mixed = index.search(onnx_queries, args.k)
+    _, full_onnx = flat_index(onnx_corpus).search(onnx_queries, args.k)
+    _, exact_flat = flat_index(torch_corpus).search(torch_queries, args.k)
+    print(f"recall@{args.k} câu hỏi {label} trên index hiện tại: {recall_at_k(mixed, exact, args.k):.4f}")
+    print(f"recall@{args.k} corpus + câu hỏi {label}:          {recall_at_k(full_onnx, exact_flat, args.k):.4f}")
+
+    for name, model in (('torch', torch_model), (label, onnx_model)):
+        p50, p99 = query_latency(model, queries)
+        print(f"Latency embed 1 câu hỏi {name:<10} p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+So sánh các loại faiss index (flat / ivf_flat / hnsw / ivf_pq): recall@k so với Flat, latency p50/p99.
+
+    python benchmarks/index_types.py --k 10 --queries 200
+    python benchmarks/index_types.py --embeddings data/embeddings.npy --query-file data/queries.txt
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database.index_factory import build_index, set_search_params, INDEX_TYPES
+from src.utils.config import INDEX_FILE
+
+NPROBE_SWEEP = [1, 4, 16, 64]
+EF_SEARCH_SWEEP = [16, 64, 256]
+
+'''lấy lại vector từ index Flat hiện có'''
+def load_embeddings(index_file):
+    index = faiss.read_index(index_file)
+    if hasattr(index, 'id_map'):
+        index = faiss.downcast_index(index.index)
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError(f"{index_file} không phải index Flat, dùng --embeddings để truyền vector gốc")
+    return index.reconstruct_n(0, index.ntotal)
+
+def load_queries(embeddings, query_file, n_queries, seed=0):
+    if query_file:
+        from src.embeddings.vn_embedder import vietnamese_embedding_batch
+        with open(query_file, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+        return vietnamese_embedding_batch(queries)
+    # không có câu hỏi thật -> lấy mẫu vector trong corpus làm query
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)
+    return embeddings[idx]
+
+def measure(index, queries, k):
+    latencies = []
+    all_ids = []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        all_ids.append(ids[0])
+    return np.array(all_ids), np.array(latencies)
+
+def recall_at_k(approx_ids, exact_ids, k):
+    hits = [len(set(a[:k]) & set(e[:k])) / k for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
+
+def run(embeddings, queries, k, index_types):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.omp_set_num_threads(1)    # đo latency cho 1 request, không dùng song song nội bộ
+
+    flat = build_index(embeddings, 'flat')
+    exact_ids, _ = measure(flat, queries, k)
+
+    rows = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type)
+        build_time = time.perf_counter() - start
+        size_mb = len(faiss.serialize_index(index)) / 1024 / 1024
+
+        if index_type in ('ivf_flat', 'ivf_pq'):
+            settings = [('nprobe', v, dict(nprobe=v)) for v in NPROBE_SWEEP]
+        elif index_type == 'hnsw':
+            settings = [('efSearch', v, dict(ef_search=v)) for v in EF_SEARCH_SWEEP]
+        else:
+            settings = [('-', '-', {})]
+
+        for param, value, params in settings:
+            set_search_params(index, **params)
+            ids, latencies = measure(index, queries, k)
+            rows.append((index_type, f"{param}={value}" if params else '-', recall_at_k(ids, exact_ids, k),
+                         np.percentile(latencies, 50), np.percentile(latencies, 99), build_time, size_mb))
+    return rows
+
+def print_report(rows, k, n_vectors, n_queries):
+    print(f"\n{n_vectors} vectors, {n_queries} queries, k={k}")
+    print(f"{'index':<10} {'params':<14} {'recall@' + str(k):>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'build (s)':>10} {'size (MB)':>10}")
+    for index_type, params, recall, p50, p99, build_time, size_mb in rows:
+        print(f"{index_type:<10} {params:<14} {recall:>10.4f} {p50:>10.3f} {p99:>10.3f} {build_time:>10.2f} {size_mb:>10.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark recall/latency các loại faiss index')
+    parser.add_argument('--index', default=INDEX_FILE, help='index Flat để lấy lại vector corpus')
+    parser.add_argument('--embeddings', help='file .npy chứa vector corpus (thay cho --index)')
+    parser.add_argument('--query-file', help='file text, mỗi dòng 1 câu hỏi')
+    parser.add_argument('--queries', type=int, default=200, help='số query lấy mẫu từ corpus nếu không có --query-file')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = parser.parse_args()
+
+    embeddings = np.load(args.embeddings) if args.embeddings else load_embeddings(args.index)
+    queries = load_queries(embeddings, args.query_file, args.queries)
+    rows = run(embeddings, queries, args.k, args.types)
+    print_report(rows, args.k, len(embeddings), len(queries))
@@ -0,0 +1,44 @@
+'''
+Precision / recall của router cục bộ (src/models/intent_router.py) trên tập câu hỏi có nhãn.
+Positive = câu hỏi cần tool; router "bỏ qua" = không gọi LLM function calling.
+
+    python benchmarks/intent_router.py
+    python benchmarks/intent_router.py --labels my_labels.json --thresholds 0.4 0.5 0.6
+'''
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.function_calling import TOOLS
+from src.models.intent_router import IntentRouter, evaluate
+from src.utils.config import INTENT_NONE_THRESHOLD
+
+LABELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_labels.json')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Đánh giá router function calling cục bộ')
+    parser.add_argument('--labels', default=LABELS_FILE, help='file json: [{"query": ..., "tool": <tên tool | null>}]')
+    parser.add_argument('--thresholds', nargs='+', type=float,
+                        default=sorted({0.3, 0.4, 0.5, 0.6, 0.7, INTENT_NONE_THRESHOLD}))
+    parser.add_argument('--show-errors', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.labels, 'r', encoding='utf-8') as f:
+        examples = json.load(f)
+    n_tool = sum(1 for e in examples if e.get('tool'))
+    print(f"{len(examples)} câu hỏi ({n_tool} cần tool, {len(examples) - n_tool} không)")
+
+    router = IntentRouter(TOOLS)
+    print(f"{'threshold':>10} {'precision':>10} {'recall':>10} {'skip_rate':>10} {'tp':>4} {'fp':>4} {'fn':>4} {'tn':>4}")
+    for threshold in args.thresholds:
+        router.none_threshold = threshold
+        result = evaluate(router, examples)
+        marker = ' *' if threshold == INTENT_NONE_THRESHOLD else ''
+        print(f"{threshold:>10.2f} {result['precision']:>10.3f} {result['recall']:>10.3f} {result['skip_rate']:>10.3f} "
+              f"{result['tp']:>4} {result['fp']:>4} {result['fn']:>4} {result['tn']:>4}{marker}")
+        if args.show_errors:
+            for query, tool, decision in result['errors']:
+                print(f"    [{tool or '-'}] {query} -> {decision.route} ({decision.reason}, {decision.score:.3f})")
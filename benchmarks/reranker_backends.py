@@ -0,0 +1,86 @@
+'''
+So sánh reranker torch (CrossEncoder fp32) với onnx (int8, batch shape cố định):
+- latency rerank 1 request (top-N chunk của 1 câu hỏi), p50/p99
+- NDCG@k của thứ tự onnx, lấy thứ tự torch làm chuẩn; tỉ lệ trùng top-1
+
+    python benchmarks/reranker_backends.py --query-file data/queries.txt --candidates 10
+    python benchmarks/reranker_backends.py --queries 100 --fp32
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.retrieval.rerank_backends import OnnxCrossEncoder
+from src.retrieval.query import get_retriever
+from src.utils.config import RERANKER_MODEL_NAME
+
+def load_queries(query_file, metadata, n_queries, seed=0):
+    if query_file:
+        with open(query_file, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    # không có câu hỏi thật -> lấy ~20 từ đầu của chunk ngẫu nhiên làm câu hỏi
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(metadata), size=min(n_queries, len(metadata)), replace=False)
+    return [' '.join(metadata[int(i)]['noidung'].split()[:20]) for i in idx]
+
+def ndcg_at_k(reference_scores, scores, k):
+    '''độ liên quan = hạng theo reference (top-1 được k điểm, top-k được 1 điểm, còn lại 0)'''
+    reference_order = np.argsort(-reference_scores)
+    relevance = np.zeros(len(reference_scores))
+    for rank, i in enumerate(reference_order[:k]):
+        relevance[i] = k - rank
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = np.sum((2 ** relevance[np.argsort(-scores)[:k]] - 1) * discounts[:min(k, len(scores))])
+    idcg = np.sum((2 ** relevance[reference_order[:k]] - 1) * discounts[:min(k, len(scores))])
+    return dcg / idcg if idcg > 0 else 1.0
+
+def rerank_latency(model, requests):
+    model.predict(requests[0], batch_size=len(requests[0]), show_progress_bar=False)    # warmup
+    latencies, all_scores = [], []
+    for pairs in requests:
+        start = time.perf_counter()
+        scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        all_scores.append(np.asarray(scores, dtype=np.float32))
+    return all_scores, np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--query-file', default=None)
+    parser.add_argument('--candidates', type=int, default=10, help='số chunk rerank mỗi câu hỏi (top_k của retrieve)')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--fp32', action='store_true', help='so với onnx fp32 thay vì int8')
+    args = parser.parse_args()
+
+    from sentence_transformers import CrossEncoder
+    retriever = get_retriever()
+    state = retriever.state()
+    queries = load_queries(args.query_file, state.metadata, args.queries)
+
+    # cùng cặp [query, chunk] như Retriever._rank
+    requests = []
+    for query in queries:
+        positions, _ = retriever.search(query, args.candidates, state)
+        chunks = [state.metadata[pos] for pos in positions]
+        requests.append([[query, f"{c.get('muc', '')} {c.get('dieu', '')} {c['noidung']}"] for c in chunks])
+    requests = [pairs for pairs in requests if pairs]
+    print(f"{len(requests)} câu hỏi, {args.candidates} chunk / câu hỏi")
+
+    label = 'onnx fp32' if args.fp32 else 'onnx int8'
+    torch_scores, torch_p50, torch_p99 = rerank_latency(CrossEncoder(RERANKER_MODEL_NAME), requests)
+    onnx_scores, onnx_p50, onnx_p99 = rerank_latency(OnnxCrossEncoder(RERANKER_MODEL_NAME, quantize=not args.fp32), requests)
+
+    ndcg = np.mean([ndcg_at_k(t, o, args.k) for t, o in zip(torch_scores, onnx_scores)])
+    top1 = np.mean([np.argmax(t) == np.argmax(o) for t, o in zip(torch_scores, onnx_scores)])
+    max_diff = max(float(np.abs(t - o).max()) for t, o in zip(torch_scores, onnx_scores))
+    print(f"\nLatency rerank / request  torch     p50 {torch_p50:.1f} ms, p99 {torch_p99:.1f} ms")
+    print(f"Latency rerank / request  {label:<9} p50 {onnx_p50:.1f} ms, p99 {onnx_p99:.1f} ms")
+    print(f"NDCG@{args.k} ({label} vs torch): {ndcg:.4f}, top-1 trùng: {top1:.2%}, lệch điểm tối đa: {max_diff:.4f}")
+
+if __name__ == '__main__':
+    main()
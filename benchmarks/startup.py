@@ -0,0 +1,81 @@
+'''
+Đo thời gian khởi động của từng entry point, mỗi lần chạy trong process mới:
+- import: thời gian import module (Gradio, FastAPI, CLI, retrieval)
+- model: thời gian load từng model trong registry lần đầu (cold), để so với phần import
+
+    python benchmarks/startup.py --runs 5
+    python benchmarks/startup.py --skip-models
+'''
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    'gradio': 'interface.gradio_app',
+    'api': 'interface.api',
+    'cli': 'src.models.llm',
+    'retrieval': 'src.retrieval.query',
+}
+
+IMPORT_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+MODEL_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, {root!r})
+from src.models.registry import get_model
+start = time.perf_counter()
+get_model({name!r})
+print(json.dumps({{"seconds": time.perf_counter() - start}}))
+'''
+
+def run_script(script):
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'lỗi không rõ')
+    return json.loads(result.stdout.strip().splitlines()[-1])['seconds']
+
+def measure(script, runs):
+    times = [run_script(script) for _ in range(runs)]
+    return float(np.median(times)), float(np.max(times))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--entry', nargs='+', default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument('--skip-models', action='store_true', help='chỉ đo import, không load model')
+    args = parser.parse_args()
+
+    print(f"{'entry point':<12} {'module':<24} {'p50 (s)':>8} {'max (s)':>8}")
+    for name in args.entry:
+        module = ENTRY_POINTS[name]
+        try:
+            p50, worst = measure(IMPORT_SCRIPT.format(root=ROOT, module=module), args.runs)
+            print(f"{name:<12} {module:<24} {p50:>8.2f} {worst:>8.2f}")
+        except RuntimeError as e:
+            print(f"{name:<12} {module:<24} lỗi: {e}")
+
+    if args.skip_models:
+        return
+    sys.path.insert(0, ROOT)
+    from src.models.registry import stats
+    print(f"\n{'model':<12} {'cold load p50 (s)':>18} {'max (s)':>8}")
+    for name in stats():
+        try:
+            p50, worst = measure(MODEL_SCRIPT.format(root=ROOT, name=name), args.runs)
+            print(f"{name:<12} {p50:>18.2f} {worst:>8.2f}")
+        except RuntimeError as e:
+            print(f"{name:<12} lỗi: {e}")
+
+if __name__ == '__main__':
+    main()
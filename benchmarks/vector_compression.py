@@ -0,0 +1,96 @@
+'''
+So sánh lưu vector nén (sq_fp16 / sq8 / opq_pq / ivf_pq) với Flat float32:
+- bytes / vector của index (serialize, không tính file float32 dùng để chấm lại)
+- recall@k so với Flat, có / không chấm lại top k * factor ứng viên bằng vector gốc (mmap)
+- latency p50/p99 cho 1 query
+
+    python benchmarks/vector_compression.py --k 10 --queries 200
+    python benchmarks/vector_compression.py --embeddings data/embeddings.npy --factors 2 4 8
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.index_types import load_embeddings, load_queries, recall_at_k
+from src.database.index_factory import build_index, save_vectors, load_vectors, rescore, vectors_file
+from src.utils.config import INDEX_FILE
+
+COMPRESSION_TYPES = ['flat', 'sq_fp16', 'sq8', 'opq_pq', 'ivf_pq']
+
+def measure(index, queries, k, vectors=None, factor=1):
+    latencies, all_ids = [], []
+    for q in queries:
+        q = q.reshape(1, -1)
+        start = time.perf_counter()
+        if vectors is None:
+            _, ids = index.search(q, k)
+            ids = ids[0]
+        else:
+            _, candidates = index.search(q, k * factor)
+            _, ids = rescore(vectors, q, candidates[0], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        all_ids.append(ids)
+    return all_ids, np.array(latencies)
+
+def run(embeddings, queries, k, index_types, factors):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.omp_set_num_threads(1)    # đo latency cho 1 request
+
+    # vector gốc đọc qua mmap như Retriever, không giữ bản trong RAM
+    tmp_dir = tempfile.mkdtemp()
+    path = vectors_file(os.path.join(tmp_dir, 'bench.index'))
+    save_vectors(embeddings, path)
+    vectors = load_vectors(path, len(embeddings))
+
+    flat = build_index(embeddings, 'flat')
+    exact_ids, _ = measure(flat, queries, k)
+
+    rows = []
+    for index_type in index_types:
+        index = flat if index_type == 'flat' else build_index(embeddings, index_type)
+        bytes_per_vector = len(faiss.serialize_index(index)) / index.ntotal
+        settings = [('-', None, 1)]
+        if index_type != 'flat':
+            settings += [(f"rescore x{factor}", vectors, factor) for factor in factors]
+        for label, rescore_vectors, factor in settings:
+            ids, latencies = measure(index, queries, k, rescore_vectors, factor)
+            rows.append((index_type, label, bytes_per_vector, recall_at_k(ids, exact_ids, k),
+                         np.percentile(latencies, 50), np.percentile(latencies, 99)))
+    os.remove(path)
+    os.rmdir(tmp_dir)
+    return rows
+
+def print_report(rows, k, n_vectors, dimension, n_queries):
+    print(f"\n{n_vectors} vectors x {dimension} chiều, {n_queries} queries, k={k}")
+    print(f"(chấm lại đọc thêm file float32 {dimension * 4} bytes / vector qua mmap, dùng chung giữa các worker)")
+    print(f"{'index':<10} {'rescore':<12} {'bytes/vec':>10} {'recall@' + str(k):>10} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for index_type, label, bytes_per_vector, recall, p50, p99 in rows:
+        print(f"{index_type:<10} {label:<12} {bytes_per_vector:>10.1f} {recall:>10.4f} {p50:>10.3f} {p99:>10.3f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark bộ nhớ / recall / latency của vector nén')
+    parser.add_argument('--index', default=INDEX_FILE, help='index Flat để lấy lại vector corpus')
+    parser.add_argument('--embeddings', help='file .npy chứa vector corpus (thay cho --index)')
+    parser.add_argument('--query-file', help='file text, mỗi dòng 1 câu hỏi')
+    parser.add_argument('--queries', type=int, default=200, help='số query lấy mẫu từ corpus nếu không có --query-file')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--factors', type=int, nargs='+', default=[2, 4, 8], help='số ứng viên = k * factor khi chấm lại')
+    parser.add_argument('--types', nargs='+', default=COMPRESSION_TYPES, choices=COMPRESSION_TYPES)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        embeddings = np.load(args.embeddings)
+    elif os.path.exists(vectors_file(args.index)):
+        embeddings = np.load(vectors_file(args.index))     # index đang dùng là index nén
+    else:
+        embeddings = load_embeddings(args.index)
+    queries = load_queries(embeddings, args.query_file, args.queries)
+    rows = run(embeddings, queries, args.k, args.types, args.factors)
+    print_report(rows, args.k, embeddings.shape[0], embeddings.shape[1], len(queries))
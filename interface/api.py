@@ -1,40 +1,163 @@
 import os
 import sys
+import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from src.models.llm import prompt_template
-from src.retrieval.query import retrieve
-from src.models.function_calling import process_query
-from langchain_community.llms.ollama import Ollama
+from src.retrieval.query import get_retriever, embedding_cache, result_cache, rerankers, pair_score_cache, adaptive_reranker
+from src.retrieval.semantic_cache import answer_cache
+from src.models.pipeline import aroute_and_retrieve
+from src.models.ollama_client import get_llm, aclose_all
+from src.models import registry
+from src.models.function_calling import prompt_stats
 from src.utils.chat_history import message_history, get_history
+from src.utils.config import API_MAX_CONCURRENCY, API_MAX_QUEUE, API_MODEL_WORKERS, MODEL_WARMUP
 
 app = FastAPI()
-llm = Ollama(model="mistral:7b")
+llm = get_llm('answer')
+
+# embedding / faiss / rerank chạy trên thread pool giới hạn, không chặn event loop
+model_executor = ThreadPoolExecutor(max_workers=API_MODEL_WORKERS, thread_name_prefix='model')
+limiter = asyncio.Semaphore(API_MAX_CONCURRENCY)
+
+class RequestMetrics:
+    def __init__(self):
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.streamed = 0
+        self.total_ttft = 0.0
+
+    def snapshot(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": API_MAX_CONCURRENCY,
+            "max_queue": API_MAX_QUEUE,
+            "model_executor_queue": model_executor._work_queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_latency": self.total_latency / self.completed if self.completed else 0.0,
+            "avg_ttft": self.total_ttft / self.streamed if self.streamed else 0.0,
+        }
+
+metrics = RequestMetrics()
+
+async def run_model(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(model_executor, functools.partial(fn, *args, **kwargs))
 
 class QueryRequest(BaseModel):
     query: str
     session_id: str  
 
+@app.on_event("startup")
+def load_retriever():
+    # load faiss index + Chunk.json 1 lần khi khởi động, các request sau dùng chung
+    get_retriever().state()
+    if MODEL_WARMUP:
+        # server nhận request ngay, model load trên thread nền
+        registry.warmup(extra=[llm.warmup, get_llm('router').warmup])
+
+@app.on_event("shutdown")
+async def close_clients():
+    await aclose_all()
+    model_executor.shutdown(wait=False)
+
+async def prepare_answer(query, session_id):
+    '''các bước trước LLM -> (answer có sẵn hoặc None, context, prompt)'''
+    # function calling (thread riêng) và retrieval (model executor) chạy song song
+    function_result, retrieval = await aroute_and_retrieve(query, session_id, run_model)
+    if function_result is not None:
+        return function_result, [], None
+    if retrieval.cached_answer is not None:
+        return retrieval.cached_answer, retrieval.context, None
+    return None, retrieval.context, prompt_template(query, retrieval.passages)
+
+async def save_history(session_id, query, answer):
+    await asyncio.to_thread(message_history, session_id, "user", query)
+    await asyncio.to_thread(message_history, session_id, "assistant", answer)
+    return await asyncio.to_thread(get_history, session_id)
+
+async def admit():
+    if metrics.waiting >= API_MAX_QUEUE:
+        metrics.rejected += 1
+        raise HTTPException(status_code=503, detail="Server đang quá tải, vui lòng thử lại sau")
+
+    metrics.waiting += 1
+    try:
+        await limiter.acquire()
+    finally:
+        metrics.waiting -= 1
+    metrics.in_flight += 1
+
+def release(start_time, failed=False):
+    if failed:
+        metrics.failed += 1
+    else:
+        metrics.completed += 1
+        metrics.total_latency += time.perf_counter() - start_time
+    metrics.in_flight -= 1
+    limiter.release()
+
+class Admission:
+    '''slot đã được admit(): release đúng 1 lần dù response kết thúc theo đường nào'''
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.failed = False
+        self.released = False
+
+    def release(self, failed=False):
+        if self.released:
+            return
+        self.released = True
+        release(self.start_time, failed or self.failed)
+
+class AdmittedStreamingResponse(StreamingResponse):
+    '''
+    generator chưa chạy lần nào (client ngắt trước khi gửi body, http.response.start lỗi) thì
+    finally trong generator không được gọi -> trả slot ở đây
+    '''
+    def __init__(self, content, admission, **kwargs):
+        super().__init__(content, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        except BaseException:
+            self.admission.failed = True
+            raise
+        finally:
+            self.admission.release()
+
 @app.post("/ask")
 async def ask(request: QueryRequest):
+    await admit()
+    start_time = time.perf_counter()
+    failed = False
     try:
         query = request.query
         session_id = request.session_id
         
-        # Process the query
-        function_result = process_query(query)
-        context, scores, retrieval_time, total_tokens = retrieve(query)
-        prompt = prompt_template(query, context, function_result)
-        answer = llm.invoke(prompt)
+        answer, context, prompt = await prepare_answer(query, session_id)
+        if answer is None:
+            answer = await llm.ainvoke(prompt)
+            await run_model(answer_cache.store, query, answer, context)
         
-        # Save to chat history
-        message_history(session_id, "user", query)
-        message_history(session_id, "assistant", answer)
-        
-        # Get full chat history
-        history = get_history(session_id)
+        # Save to chat history, get full chat history
+        history = await save_history(session_id, query, answer)
         
         return {
             "status": "success",
@@ -43,7 +166,76 @@ async def ask(request: QueryRequest):
             "history": history
         }
     except Exception as e:
+        failed = True
         raise HTTPException(
             status_code=500,
             detail=f"Error processing request: {str(e)}"
-        )
\ No newline at end of file
+        )
+    finally:
+        release(start_time, failed)
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_stream(request: QueryRequest):
+    '''
+    Server-Sent Events: "context" -> nhiều "token" -> "done" (kèm ttft, total_time) hoặc "error".
+    '''
+    await admit()
+    admission = Admission()
+    start_time = admission.start_time
+
+    async def events():
+        try:
+            query = request.query
+            session_id = request.session_id
+
+            answer, context, prompt = await prepare_answer(query, session_id)
+            yield sse("context", {"context": context})
+
+            ttft = None
+            if answer is not None:
+                # function calling / semantic cache: có câu trả lời ngay, gửi 1 lần
+                ttft = time.perf_counter() - start_time
+                yield sse("token", {"token": answer})
+            else:
+                parts = []
+                async for token in llm.astream(prompt):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start_time
+                    parts.append(token)
+                    yield sse("token", {"token": token})
+                answer = ''.join(parts)
+                await run_model(answer_cache.store, query, answer, context)
+
+            await save_history(session_id, query, answer)
+            if ttft is not None:
+                metrics.streamed += 1
+                metrics.total_ttft += ttft
+            yield sse("done", {"ttft": ttft, "total_time": time.perf_counter() - start_time})
+        except Exception as e:
+            admission.failed = True
+            yield sse("error", {"detail": f"Error processing request: {str(e)}"})
+        finally:
+            admission.release()
+
+    return AdmittedStreamingResponse(events(), admission, media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics")
+async def request_metrics():
+    return metrics.snapshot()
+
+@app.get("/stats")
+async def stats():
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "rerankers": [reranker.stats() for reranker, _ in rerankers],
+        "pair_score_cache": pair_score_cache.stats(),
+        "adaptive_rerank": adaptive_reranker.stats(),
+        "models": registry.stats(),
+        "function_calling_prompt": prompt_stats(),
+    }
@@ -1,4 +1,5 @@
 import uuid
+import time
 import gradio as gr
 from datetime import datetime
 import logging
@@ -12,9 +13,12 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 # Internal imports
 from src.models.llm import prompt_template
-from src.retrieval.query import retrieve
-from src.models.function_calling import process_query
-from langchain_community.llms.ollama import Ollama
+from src.retrieval.query import get_retriever
+from src.retrieval.semantic_cache import answer_cache
+from src.models.pipeline import route_and_retrieve
+from src.models.ollama_client import get_llm
+from src.models import registry
+from src.utils.config import MODEL_WARMUP
 from src.utils.chat_history import (
     message_history,
     get_history,
@@ -31,24 +35,11 @@ logger = logging.getLogger(__name__)
 # Redis
 r = redis.Redis(host='localhost', port=6379, db=0)
 
-# LLM
-print('Đang kết nối Mistral-7B...')
-try:
-    llm = Ollama(
-        model="mistral:7b",  
-        temperature=0.7,     
-        top_k=10,
-        top_p=0.9,
-        repeat_penalty=1.1,
-        num_ctx=4096,  
-        stop=['Question:', 'Câu hỏi:', 'Human:', 'Assistant:']
-    )
-    print('Kết nối Ollama thành công')
-except Exception as e:
-    print(f'Lỗi kết nối Ollama: {str(e)}')
-    sys.exit(1)
+# LLM: client dùng chung, giữ kết nối tới Ollama
+llm = get_llm('chat')
 
-def qa_pipeline(query, session_id):
+def qa_pipeline_stream(query, session_id):
+    '''yield lịch sử chat mỗi khi câu trả lời có thêm token'''
     try:
         logger.info(f"Processing query for session {session_id}: {query}")
         
@@ -58,30 +49,42 @@ def qa_pipeline(query, session_id):
         chat_history = [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
                        for msg in current_history]
         
-        try:
-            print("\nĐang phân tích câu hỏi...")
-            function_result = process_query(query, session_id)
+        # Function calling và retrieval chạy song song, nhánh không cần sẽ bị huỷ
+        print("\nĐang phân tích câu hỏi và tìm kiếm thông tin liên quan...")
+        function_result, retrieval = route_and_retrieve(query, session_id)
             
-            if function_result is not None:
-                # Lưu câu trả lời
-                message_history(session_id, "assistant", function_result)
-                
-                if not get_session(session_id):
-                    create_session(session_id, {
-                        "title": query[:50] + "..." if len(query) > 50 else query,
-                        "created_at": datetime.now().isoformat()
-                    })
-                
-                # Lấy lịch sử mới nhất
-                updated_history = get_history(session_id)
-                return [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
-                        for msg in updated_history]
-                    
-        except Exception as e:
-            logger.error(f"Lỗi khi xử lý function calling: {str(e)}")
+        if function_result is not None:
+            # Lưu câu trả lời
+            message_history(session_id, "assistant", function_result)
+            
+            if not get_session(session_id):
+                create_session(session_id, {
+                    "title": query[:50] + "..." if len(query) > 50 else query,
+                    "created_at": datetime.now().isoformat()
+                })
+            
+            # Lấy lịch sử mới nhất
+            updated_history = get_history(session_id)
+            yield [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
+                   for msg in updated_history]
+            return
         
-        print("\nĐang tìm kiếm thông tin liên quan...")
-        context, scores, retrieval_time, total_tokens = retrieve(query)
+        # Câu hỏi tương tự đã được trả lời -> dùng lại, không gọi LLM
+        if retrieval.cached_answer is not None:
+            answer = retrieval.cached_answer
+            logger.info(f"Semantic cache hit cho session {session_id}")
+            message_history(session_id, "assistant", answer)
+            if not get_session(session_id):
+                create_session(session_id, {
+                    "title": query[:50] + "..." if len(query) > 50 else query,
+                    "created_at": datetime.now().isoformat()
+                })
+            cached_history = get_history(session_id)
+            yield [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
+                   for msg in cached_history]
+            return
+
+        context, scores, total_tokens = retrieval.context, retrieval.scores, retrieval.total_tokens
         
         # In ra context và scores để debug
         print("\nCác đoạn văn bản liên quan:")
@@ -94,9 +97,10 @@ def qa_pipeline(query, session_id):
 
         # Quyết định dựa trên tổng số token từ retrieval
         MIN_TOKENS_THRESHOLD = 150
-        if total_tokens >= MIN_TOKENS_THRESHOLD:
+        grounded = total_tokens >= MIN_TOKENS_THRESHOLD
+        if grounded:
             print(f"\nSử dụng thông tin từ các đoạn văn bản trên để trả lời (tổng số tokens: {total_tokens})")
-            prompt = prompt_template(query, context)
+            prompt = prompt_template(query, retrieval.passages)
         else:
             print(f"\nSố token quá ít ({total_tokens}), sử dụng kiến thức có sẵn để trả lời")
             prompt = f'''Bạn là một luật sư chuyên nghiệp người Việt Nam. 
@@ -111,8 +115,19 @@ Câu hỏi: {query}
 
 Trả lời bằng tiếng Việt:'''
 
-        # Gọi LLM để trả lời
-        answer = llm.invoke(prompt)
+        # Gọi LLM để trả lời, hiển thị dần từng token
+        answer = ''
+        llm_start = time.time()
+        first_token_time = None
+        for token in llm.stream(prompt):
+            if first_token_time is None:
+                first_token_time = time.time() - llm_start
+                logger.info(f"Time to first token: {first_token_time:.2f} giây")
+            answer += token
+            yield chat_history + [(None, answer)]
+        logger.info(f"Time response: {time.time() - llm_start:.2f} giây")
+        # chỉ cache câu trả lời dựa trên context pháp luật, không cache câu trả lời từ prompt fallback
+        answer_cache.store(query, answer, context, grounded=grounded)
         
         # Lưu câu trả lời
         message_history(session_id, "assistant", answer)
@@ -125,8 +140,8 @@ Trả lời bằng tiếng Việt:'''
 
         # Lấy lịch sử mới nhất
         final_history = get_history(session_id)
-        return [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
-                for msg in final_history]
+        yield [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
+               for msg in final_history]
                 
     except Exception as e:
         logger.error(f"Error in qa_pipeline: {str(e)}")
@@ -135,8 +150,14 @@ Trả lời bằng tiếng Việt:'''
         # Lưu thông báo lỗi
         message_history(session_id, "assistant", error_message)
         error_history = get_history(session_id)
-        return [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
-                for msg in error_history]
+        yield [(msg["content"], None) if msg["role"] == "user" else (None, msg["content"]) 
+               for msg in error_history]
+
+def qa_pipeline(query, session_id):
+    history = []
+    for history in qa_pipeline_stream(query, session_id):
+        pass
+    return history
 
 def load_session(session_id):
     history = get_history(session_id)
@@ -219,20 +240,24 @@ def update_session_list():
 def on_submit(query, chat_history, session_id):
     try:
         if not query.strip():
-            return chat_history, "", update_session_list()
+            yield chat_history, "", update_session_list()
+            return
         
         # Show user message immediately
         new_history = chat_history + [(query, None)]
+        yield new_history, "", gr.update()
         
-        # Get bot response
-        bot_history = qa_pipeline(query, session_id)
+        # Get bot response, cập nhật giao diện theo từng token
+        bot_history = new_history
+        for bot_history in qa_pipeline_stream(query, session_id):
+            yield bot_history, "", gr.update()
         
-        return bot_history, "", update_session_list()
+        yield bot_history, "", update_session_list()
     except Exception as e:
         logger.error(f"Error in on_submit: {str(e)}")
         error_message = [(query, f"Xin lỗi, đã có lỗi xảy ra: {str(e)}")]
         history = error_message if not chat_history else chat_history + error_message
-        return history, "", update_session_list()
+        yield history, "", update_session_list()
 
 # Gradio UI
 with gr.Blocks(css=css) as demo:
@@ -301,6 +326,9 @@ with gr.Blocks(css=css) as demo:
 
 # Run app
 if __name__ == "__main__":
+    get_retriever().state()  # load index 1 lần trước khi nhận request
+    if MODEL_WARMUP:
+        registry.warmup(extra=[llm.warmup, get_llm('router').warmup])
     demo.launch(
         show_error=True,
         share=True,  # Enable temporary public URL
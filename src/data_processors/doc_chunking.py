@@ -1,5 +1,8 @@
+import os
 import re
 import json
+import hashlib
+import numpy as np
 
 def count_tokens(text: str) -> int:
     return len(text.split())
@@ -35,6 +38,53 @@ def split_text(text: str, max_tokens: int = 500, chunk_overlap: int = 50) -> lis
         chunk.append(current_chunk.strip())
     return chunk
 
+'''id ổn định cho chunk = hash nội dung (chuong/muc/dieu/noidung), dùng cho faiss IndexIDMap'''
+def chunk_hash(chunk: dict) -> str:
+    content = json.dumps([chunk.get('chuong') or '', chunk.get('muc') or '', chunk.get('dieu') or '', chunk.get('noidung') or ''],
+                         ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def chunk_id(chunk: dict) -> int:
+    return int(chunk_hash(chunk)[:15], 16)     # 60 bit -> vừa int64 của faiss
+
+'''chunk -> đoạn văn bản đưa vào prompt / trả về cho người dùng'''
+def chunk_answer(chunk: dict) -> str:
+    return f"Theo {chunk.get('chuong', '')} {chunk.get('muc', '')} {chunk.get('dieu', '')}, {chunk.get('noidung', '')}"
+
+'''số token (tokenizer embedding) của từng chunk_answer, tính 1 lần lúc build index, lưu cạnh Chunk.json'''
+def token_counts_file(chunk_file: str) -> str:
+    return os.path.splitext(chunk_file)[0] + '.tokens.npz'
+
+def count_chunk_tokens(chunks: list[dict], tokenizer) -> list[int]:
+    if not chunks:
+        return []
+    encoded = tokenizer([chunk_answer(chunk) for chunk in chunks])
+    return [len(ids) for ids in encoded['input_ids']]
+
+def save_token_counts(path: str, counts: dict) -> None:
+    ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int32, count=len(counts))
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, ids=ids, counts=values)
+    os.replace(tmp_path, path)
+
+def load_token_counts(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        return dict(zip(data['ids'].tolist(), data['counts'].tolist()))
+
+def update_token_counts(chunks: list[dict], chunk_file: str, tokenizer) -> dict:
+    '''chỉ đếm token cho chunk chưa có trong file, bỏ chunk không còn trong Chunk.json'''
+    path = token_counts_file(chunk_file)
+    known = load_token_counts(path)
+    ids = [chunk_id(chunk) for chunk in chunks]
+    missing = {i: chunk for i, chunk in zip(ids, chunks) if i not in known}
+    known.update(zip(missing.keys(), count_chunk_tokens(list(missing.values()), tokenizer)))
+    counts = {i: known[i] for i in ids}
+    save_token_counts(path, counts)
+    return counts
+
 def chunking_text(lines: list[str], max_tokens: int = 500, chunk_overlap: int = 50) -> list[dict]:
     chunks = []
     chuong, muc, dieu = None, None, None
@@ -149,4 +199,5 @@ if __name__ == '__main__':
 
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(chunks, f, ensure_ascii=False, indent=2)
+    # Chunk.store do vn_embedder / incremental_index ghi cùng lúc với index, không ghi ở đây
     print(f"Saved {len(chunks)} chunks to: {output_path}")
\ No newline at end of file
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.data_processors.doc_chunking import chunk_id
+
+logger = logging.getLogger(__name__)
+
+'''
+Chunk store nhị phân thay cho việc json.load cả Chunk.json:
+- noidung của mọi chunk nối thành 1 khối utf-8, đọc theo offset qua mmap -> lấy 1 chunk không cần load cả corpus
+- chuong / muc / dieu lặp lại rất nhiều -> lưu 1 lần trong bảng nhãn, mỗi chunk chỉ giữ 3 chỉ số
+- chunk_ids (hash nội dung) ghi sẵn -> Retriever không phải hash lại lúc load
+
+Layout (little-endian):
+    header  '<8sIII4xQQ'  magic, version, n_chunks, n_labels, text_bytes, label_bytes (40 byte)
+    chunk_ids       int64[n_chunks]
+    text_offsets    int64[n_chunks + 1]
+    label_offsets   int64[n_labels + 1]
+    labels          int32[n_chunks, 3]      chỉ số chuong, muc, dieu trong bảng nhãn
+    text blob, label blob
+mảng int64 đứng trước int32 để mảng nào cũng align khi np.frombuffer trên mmap
+'''
+MAGIC = b'NEOCHUNK'
+CHUNK_STORE_VERSION = 1
+HEADER = struct.Struct('<8sIII4xQQ')
+LABEL_FIELDS = ('chuong', 'muc', 'dieu')
+
+def chunk_store_file(chunk_file: str) -> str:
+    return os.path.splitext(chunk_file)[0] + '.store'
+
+def _blob(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return b''.join(encoded), offsets
+
+def write_chunk_store(chunks: list[dict], path: str) -> None:
+    labels, label_index = [], {}
+    label_ids = np.empty((len(chunks), len(LABEL_FIELDS)), dtype=np.int32)
+    for i, chunk in enumerate(chunks):
+        for j, field in enumerate(LABEL_FIELDS):
+            label = chunk.get(field) or ''
+            if label not in label_index:
+                label_index[label] = len(labels)
+                labels.append(label)
+            label_ids[i, j] = label_index[label]
+    text_blob, text_offsets = _blob([chunk.get('noidung') or '' for chunk in chunks])
+    label_blob, label_offsets = _blob(labels)
+    chunk_ids = np.array([chunk_id(chunk) for chunk in chunks], dtype=np.int64)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, CHUNK_STORE_VERSION, len(chunks), len(labels), len(text_blob), len(label_blob)))
+        for array in (chunk_ids, text_offsets, label_offsets, label_ids):
+            f.write(array.tobytes())
+        f.write(text_blob)
+        f.write(label_blob)
+    # Retriever đang mmap file cũ vẫn đọc được bản cũ sau khi rename
+    os.replace(tmp_path, path)
+
+class ChunkStore:
+    '''đọc chunk theo vị trí như list[dict]: len(), store[pos], for chunk in store'''
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, n_labels, text_bytes, label_bytes = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != CHUNK_STORE_VERSION:
+            raise ValueError(f"{path} không phải chunk store v{CHUNK_STORE_VERSION}")
+        offset = HEADER.size
+        self.chunk_ids = np.frombuffer(self._mm, dtype=np.int64, count=n, offset=offset)
+        offset += 8 * n
+        self._text_offsets = np.frombuffer(self._mm, dtype=np.int64, count=n + 1, offset=offset)
+        offset += 8 * (n + 1)
+        label_offsets = np.frombuffer(self._mm, dtype=np.int64, count=n_labels + 1, offset=offset).tolist()
+        offset += 8 * (n_labels + 1)
+        self.label_ids = np.frombuffer(self._mm, dtype=np.int32, count=n * len(LABEL_FIELDS), offset=offset).reshape(n, -1)
+        offset += 4 * n * len(LABEL_FIELDS)
+        self._text_start = offset
+        label_start = offset + text_bytes
+        # bảng nhãn nhỏ -> decode 1 lần, mọi chunk dùng chung object str
+        self.labels = [self._mm[label_start + label_offsets[i]:label_start + label_offsets[i + 1]].decode('utf-8')
+                       for i in range(n_labels)]
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def text(self, pos: int) -> str:
+        start = self._text_start + int(self._text_offsets[pos])
+        end = self._text_start + int(self._text_offsets[pos + 1])
+        return self._mm[start:end].decode('utf-8')
+
+    def chunk_labels(self, pos: int) -> tuple:
+        return tuple(self.labels[i] for i in self.label_ids[pos])
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        pos = int(pos)
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError(pos)
+        chunk = dict(zip(LABEL_FIELDS, self.chunk_labels(pos)))
+        chunk['noidung'] = self.text(pos)
+        return chunk
+
+    def __iter__(self):
+        for pos in range(len(self)):
+            yield self[pos]
+
+    def iter_labels(self):
+        '''(chuong, muc, dieu) từng chunk, không phải decode noidung'''
+        for ids in self.label_ids.tolist():
+            yield tuple(self.labels[i] for i in ids)
+
+def iter_labels(chunks):
+    if isinstance(chunks, ChunkStore):
+        return chunks.iter_labels()
+    return ((chunk.get('chuong') or '', chunk.get('muc') or '', chunk.get('dieu') or '') for chunk in chunks)
+
+def chunk_source(chunk_file: str) -> str:
+    '''file thực sự được đọc: chunk store nếu có và không cũ hơn Chunk.json, ngược lại Chunk.json'''
+    store_path = chunk_store_file(chunk_file)
+    if not os.path.exists(store_path):
+        return chunk_file
+    if os.path.exists(chunk_file) and os.stat(chunk_file).st_mtime_ns > os.stat(store_path).st_mtime_ns:
+        return chunk_file
+    return store_path
+
+def load_chunks(chunk_file: str):
+    '''-> (chunks, chunk_ids): ChunkStore nếu dùng được, không thì fallback json.load Chunk.json'''
+    source = chunk_source(chunk_file)
+    if source != chunk_file:
+        try:
+            store = ChunkStore(source)
+            return store, store.chunk_ids.tolist()
+        except (ValueError, OSError, struct.error) as e:
+            logger.error(f"Không đọc được {source}, dùng {chunk_file}: {str(e)}")
+    with open(chunk_file, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    return chunks, [chunk_id(chunk) for chunk in chunks]
@@ -0,0 +1,107 @@
+import os
+import sys
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.config import (
+    INDEX_TYPE, IVF_NLIST, IVF_NPROBE, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, PQ_M, PQ_NBITS
+)
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'hnsw', 'ivf_pq', 'sq_fp16', 'sq8', 'opq_pq')
+# index lưu vector nén (điểm xấp xỉ) -> nên chấm lại top ứng viên bằng vector float32 gốc
+COMPRESSED_INDEX_TYPES = ('ivf_pq', 'sq_fp16', 'sq8', 'opq_pq')
+
+def default_nlist(n_vectors):
+    # ~4*sqrt(n) cluster, mỗi cluster ít nhất 39 vector để k-means không bị cảnh báo
+    return max(1, min(int(4 * np.sqrt(n_vectors)), n_vectors // 39))
+
+def _pq_m(dimension, pq_m):
+    # sub-quantizer phải chia hết dimension
+    while dimension % pq_m:
+        pq_m -= 1
+    return pq_m
+
+def _pq_nbits(n_vectors, pq_nbits):
+    # mỗi codebook 2^nbits centroid, cần ~39 điểm train / centroid
+    return max(1, min(pq_nbits, int(np.log2(max(n_vectors // 39, 2)))))
+
+'''tạo index rỗng theo loại (chưa train)'''
+def create_index(dimension, n_vectors, index_type=INDEX_TYPE, nlist=IVF_NLIST, hnsw_m=HNSW_M,
+                 ef_construction=HNSW_EF_CONSTRUCTION, pq_m=PQ_M, pq_nbits=PQ_NBITS):
+    nlist = nlist or default_nlist(n_vectors)
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+    if index_type == 'ivf_flat':
+        quantizer = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    if index_type == 'ivf_pq':
+        quantizer = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_m(dimension, pq_m), _pq_nbits(n_vectors, pq_nbits),
+                                faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'sq_fp16':
+        # 2 byte / chiều, gần như không mất recall
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'sq8':
+        # 1 byte / chiều, min/max từng chiều học lúc train
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'opq_pq':
+        # xoay vector (OPQ, ma trận trực giao -> giữ nguyên inner product) rồi PQ: pq_m * pq_nbits / 8 byte / vector
+        pq_m = _pq_m(dimension, pq_m)
+        pq = faiss.IndexPQ(dimension, pq_m, _pq_nbits(n_vectors, pq_nbits), faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexPreTransform(faiss.OPQMatrix(dimension, pq_m), pq)
+    raise ValueError(f"index_type không hợp lệ: {index_type} (chọn một trong {', '.join(INDEX_TYPES)})")
+
+'''tham số lúc search: nprobe cho IVF, efSearch cho HNSW'''
+def set_search_params(index, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH):
+    base = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if hasattr(base, 'hnsw'):
+        base.hnsw.efSearch = ef_search
+    return index
+
+'''build index: tạo + train trên chính corpus + add'''
+def build_index(embeddings, index_type=INDEX_TYPE, nprobe=IVF_NPROBE, ef_search=HNSW_EF_SEARCH, **kwargs):
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n_vectors, dimension = embeddings.shape
+    index = create_index(dimension, n_vectors, index_type, **kwargs)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return set_search_params(index, nprobe, ef_search)
+
+'''vector float32 gốc, lưu cạnh index theo thứ tự id faiss -> np.load(mmap_mode='r') để chấm lại điểm chính xác'''
+def vectors_file(index_file):
+    return os.path.splitext(index_file)[0] + '.vectors.npy'
+
+def save_vectors(embeddings, path):
+    # ghi file tạm rồi rename như file index
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(embeddings, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+def load_vectors(path, ntotal):
+    '''mmap: các worker cùng máy dùng chung page cache, không mỗi process 1 bản'''
+    if not os.path.exists(path):
+        return None
+    vectors = np.load(path, mmap_mode='r')
+    return vectors if vectors.shape[0] == ntotal else None     # file của lần build khác -> bỏ qua
+
+'''chấm lại ứng viên của index nén bằng vector gốc -> (scores, ids) top_k, giảm dần'''
+def rescore(vectors, query, ids, top_k):
+    ids = ids[ids >= 0]
+    if not len(ids):
+        return np.zeros(0, dtype=np.float32), ids
+    # đọc theo thứ tự id tăng dần cho truy cập mmap tuần tự hơn
+    ids = np.sort(ids)
+    scores = np.asarray(vectors[ids], dtype=np.float32) @ np.asarray(query, dtype=np.float32).reshape(-1)
+    order = np.argsort(-scores)[:top_k]
+    return scores[order], ids[order]
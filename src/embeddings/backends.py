@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.config import ONNX_MODEL_DIR, ONNX_INTRA_OP_THREADS, ONNX_QUANTIZE, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+logger = logging.getLogger(__name__)
+
+'''
+Backend cho embedding model: cùng interface encode(texts) -> vector CLS đã L2 normalize (float32)
+- torch: AutoModel PyTorch như trước
+- onnx: model export sang ONNX, quantize dynamic int8, chạy bằng ONNX Runtime trên CPU
+'''
+def _sorted_batches(tokenizer, texts, batch_size, max_length, show_progress, desc):
+    '''tokenize 1 lần, sắp xếp theo số token để mỗi batch gồm các câu dài gần bằng nhau -> ít padding'''
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    order = np.argsort([len(ids) for ids in encoded['input_ids']], kind='stable')
+    for start in tqdm(range(0, len(texts), batch_size), desc=desc, disable=not show_progress):
+        batch_idx = order[start:start + batch_size]
+        features = [{key: encoded[key][i] for key in encoded.keys()} for i in batch_idx]
+        yield batch_idx, features
+
+def _normalize(cls):
+    norms = np.linalg.norm(cls, axis=1, keepdims=True)
+    return cls / np.where(norms > 0, norms, 1.0)
+
+class TorchEmbedder:
+    backend = 'torch'
+
+    def __init__(self, model_name):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model.to(self.device).eval()
+        self.dimension = self.model.config.hidden_size
+
+    def encode(self, texts, batch_size=32, max_length=500, show_progress=False):
+        import torch
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for batch_idx, features in _sorted_batches(self.tokenizer, texts, batch_size, max_length, show_progress,
+                                                   "Creating embeddings"):
+            inputs = self.tokenizer.pad(features, return_tensors='pt').to(self.device)
+            with torch.inference_mode():
+                outputs = self.model(**inputs)
+            # CLS + L2 normalize cho cả batch
+            embeddings[batch_idx] = _normalize(outputs.last_hidden_state[:, 0, :].float().cpu().numpy())
+        return embeddings
+
+'''---------------- onnx ----------------'''
+def onnx_model_dir(model_name):
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace('/', '__'))
+
+def onnx_model_path(model_name, quantize=ONNX_QUANTIZE):
+    return os.path.join(onnx_model_dir(model_name), 'model.int8.onnx' if quantize else 'model.onnx')
+
+def export_embedding_onnx(model_name, quantize=True, opset=17):
+    '''export AutoModel -> ONNX (chỉ lấy vector CLS), rồi quantize dynamic int8 cho CPU'''
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+
+    out_dir = onnx_model_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    class ClsWrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, 0, :]
+
+    start = time.time()
+    sample = tokenizer(['xin chào', 'người lao động'], padding=True, return_tensors='pt')
+    fp32_path = onnx_model_path(model_name, quantize=False)
+    torch.onnx.export(
+        ClsWrapper(model), (sample['input_ids'], sample['attention_mask']), fp32_path,
+        input_names=['input_ids', 'attention_mask'], output_names=['cls'],
+        dynamic_axes={'input_ids': {0: 'batch', 1: 'seq'}, 'attention_mask': {0: 'batch', 1: 'seq'}, 'cls': {0: 'batch'}},
+        opset_version=opset,
+    )
+    tokenizer.save_pretrained(out_dir)
+    logger.info(f"Export {model_name} -> {fp32_path} ({time.time() - start:.1f}s)")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = onnx_model_path(model_name, quantize=True)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, per_channel=True)
+        logger.info(f"Quantize int8 -> {int8_path} ({os.path.getsize(fp32_path) >> 20} MB -> {os.path.getsize(int8_path) >> 20} MB)")
+    return onnx_model_path(model_name, quantize)
+
+_intra_op_threads = ONNX_INTRA_OP_THREADS
+
+def set_onnx_threads(num_threads):
+    '''worker build index song song: chia CPU cho các process, gọi trước khi load model'''
+    global _intra_op_threads
+    _intra_op_threads = num_threads
+
+def create_session(path, intra_op_threads=None):
+    import onnxruntime as ort
+    intra_op_threads = _intra_op_threads if intra_op_threads is None else intra_op_threads
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads     # 0 = để ONNX Runtime tự chọn
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+class OnnxEmbedder:
+    backend = 'onnx'
+
+    def __init__(self, model_name, quantize=ONNX_QUANTIZE, intra_op_threads=None):
+        from transformers import AutoTokenizer
+        path = onnx_model_path(model_name, quantize)
+        if not os.path.exists(path):
+            # lần đầu dùng backend onnx -> export + quantize 1 lần, lưu lại cho các lần sau
+            logger.info(f"Chưa có {path}, export {model_name} sang ONNX")
+            export_embedding_onnx(model_name, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_model_dir(model_name))
+        self.session = create_session(path, intra_op_threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.dimension = self.session.get_outputs()[0].shape[-1]
+
+    def encode(self, texts, batch_size=32, max_length=500, show_progress=False):
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for batch_idx, features in _sorted_batches(self.tokenizer, texts, batch_size, max_length, show_progress,
+                                                   "Creating embeddings (onnx)"):
+            inputs = self.tokenizer.pad(features, return_tensors='np')
+            feeds = {name: inputs[name].astype(np.int64) for name in self.input_names}
+            cls = self.session.run(None, feeds)[0]
+            embeddings[batch_idx] = _normalize(cls.astype(np.float32))
+        return embeddings
+
+EMBEDDING_BACKENDS = {'torch': TorchEmbedder, 'onnx': OnnxEmbedder}
+
+def load_embedder(model_name, backend='torch'):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND '{backend}' không hợp lệ, chọn: {', '.join(EMBEDDING_BACKENDS)}")
+    return EMBEDDING_BACKENDS[backend](model_name)
+
+'''model + backend (+ int8/fp32 với onnx) sinh ra vector: dùng làm khoá cho shard và cache embedding'''
+def embedding_identity(model_name=EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND, quantize=ONNX_QUANTIZE):
+    return {'model': model_name, 'backend': backend, 'quantize': quantize if backend == 'onnx' else None}
+
+def embedding_namespace(**kwargs):
+    identity = embedding_identity(**kwargs)
+    suffix = {True: ':int8', False: ':fp32', None: ''}[identity['quantize']]
+    return f"{identity['model']}:{identity['backend']}{suffix}"
+
+if __name__ == '__main__':
+    # export trước khi deploy: python src/embeddings/backends.py
+    from src.utils.config import EMBEDDING_MODEL_NAME
+    logging.basicConfig(level=logging.INFO)
+    print(export_embedding_onnx(EMBEDDING_MODEL_NAME, quantize=ONNX_QUANTIZE))
@@ -0,0 +1,71 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.data_processors.doc_chunking import chunk_id, update_token_counts
+from src.retrieval.bm25 import load_or_build_bm25
+from src.database.chunk_store import write_chunk_store, chunk_store_file
+from src.embeddings.vn_embedder import get_embedding, vietnamese_embedding_batch
+from src.models.registry import get_model
+from src.utils.config import INDEX_FILE, CHUNK_FILE
+
+'''load index có id (IndexIDMap2 + IndexFlatIP), index khác -> build lại từ đầu'''
+def load_id_index(file_index, dimension):
+    if os.path.exists(file_index):
+        index = faiss.read_index(file_index)
+        if hasattr(index, 'id_map'):
+            return index
+        print(f"{file_index} không có id theo chunk, build lại toàn bộ")
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+
+'''cập nhật index: chỉ embedding chunk mới/đã sửa, xoá vector của chunk không còn trong Chunk.json'''
+def update_embedding(file_path, file_index, batch_size=32):
+    start_time = time.time()
+    os.makedirs(os.path.dirname(file_index), exist_ok=True)
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+
+    wanted = {}
+    for chunk in chunks:
+        text = get_embedding(chunk)
+        if text:
+            wanted.setdefault(chunk_id(chunk), text)
+
+    embedder = get_model('embedding')
+    index = load_id_index(file_index, embedder.dimension)
+    existing = set(faiss.vector_to_array(index.id_map).tolist())
+
+    stale_ids = np.array(sorted(existing - wanted.keys()), dtype=np.int64)
+    new_ids = np.array(sorted(wanted.keys() - existing), dtype=np.int64)
+
+    if len(stale_ids):
+        index.remove_ids(stale_ids)
+    if len(new_ids):
+        embeddings = vietnamese_embedding_batch([wanted[i] for i in new_ids.tolist()], batch_size=batch_size)
+        index.add_with_ids(embeddings, new_ids)
+
+    update_token_counts(chunks, file_path, embedder.tokenizer)
+    load_or_build_bm25(chunks, file_path)
+    write_chunk_store(chunks, chunk_store_file(file_path))
+
+    if len(stale_ids) or len(new_ids) or not os.path.exists(file_index):
+        # Retriever đọc lại index khi file đổi -> ghi file tạm rồi rename
+        tmp_index = file_index + '.tmp'
+        faiss.write_index(index, tmp_index)
+        os.replace(tmp_index, file_index)
+
+    print(f"Thêm {len(new_ids)}, xoá {len(stale_ids)}, giữ {len(existing) - len(stale_ids)} vectors "
+          f"({index.ntotal} tổng) trong {time.time() - start_time:.2f} giây")
+    return len(new_ids), len(stale_ids)
+
+if __name__ == '__main__':
+    input_file = CHUNK_FILE
+    file_index = INDEX_FILE
+    batch_size = int(os.getenv('EMBED_BATCH_SIZE', 32))
+    update_embedding(input_file, file_index, batch_size=batch_size)
@@ -1,14 +1,24 @@
 import json 
 import os
+import sys
+import shutil
+import hashlib
+import multiprocessing as mp
 import numpy as np 
-import torch 
 import faiss 
-from transformers import AutoTokenizer, AutoModel
 from tqdm import tqdm
 
-'''Vietnamese Embedding '''
-tokenizer = AutoTokenizer.from_pretrained('truro7/vn-law-embedding')
-model = AutoModel.from_pretrained('truro7/vn-law-embedding')
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.database.index_factory import build_index, COMPRESSED_INDEX_TYPES, vectors_file, save_vectors
+from src.data_processors.doc_chunking import update_token_counts
+from src.retrieval.bm25 import load_or_build_bm25
+from src.database.chunk_store import write_chunk_store, chunk_store_file
+from src.models.registry import get_model, is_loaded
+from src.embeddings.backends import set_onnx_threads, embedding_identity
+from src.utils.config import INDEX_TYPE, INDEX_FILE, CHUNK_FILE, EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME
+
+'''Vietnamese Embedding: tokenizer + model dùng chung với retrieval, lấy qua registry'''
 
 '''concat'''
 def get_embedding(chunk):
@@ -25,36 +35,116 @@ def get_embedding(chunk):
 
 '''embedding'''
 def vietnamese_embedding(text):
-    inputs = tokenizer(text, return_tensors='pt', padding=True, truncation=True, max_length=500)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    embedding = outputs.last_hidden_state[:, 0, :].numpy().flatten()
-    norm = np.linalg.norm(embedding)
-    return embedding / norm if norm > 0 else embedding
-
-def save_embedding(file_path, file_index):
+    return get_model('embedding').encode([text], batch_size=1)[0]
+
+'''embedding theo batch (length-sorted, xem src/embeddings/backends.py), backend theo EMBEDDING_BACKEND'''
+def vietnamese_embedding_batch(texts, batch_size=32, max_length=500, show_progress=True):
+    return get_model('embedding').encode(texts, batch_size=batch_size, max_length=max_length, show_progress=show_progress)
+
+'''sharded build: mỗi worker 1 bản model, ghi từng shard ra .npy để build lại được khi bị crash'''
+def _init_worker(num_threads):
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    if EMBEDDING_BACKEND == 'onnx':
+        set_onnx_threads(num_threads)
+    else:
+        import torch
+        torch.set_num_threads(num_threads)
+
+def _embed_shard(args):
+    shard_path, texts, batch_size = args
+    embeddings = vietnamese_embedding_batch(texts, batch_size=batch_size, show_progress=False)
+    tmp_path = shard_path + '.tmp.npy'
+    np.save(tmp_path, embeddings)
+    os.replace(tmp_path, shard_path)     # shard chỉ xuất hiện khi đã ghi xong
+    return shard_path
+
+def _shard_manifest(shard_dir, texts, shard_size):
+    checksum = hashlib.sha1('\x00'.join(texts).encode('utf-8')).hexdigest()
+    # vector của model / backend khác (torch vs onnx int8) lệch nhau -> không được trộn trong 1 index
+    manifest = {'num_texts': len(texts), 'shard_size': shard_size, 'checksum': checksum, **embedding_identity()}
+    manifest_path = os.path.join(shard_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == manifest:
+                return
+        # corpus, shard_size hoặc model / backend đã đổi -> shard cũ không dùng lại được
+        print(f"Chunk hoặc model thay đổi, xoá shard cũ trong {shard_dir}")
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+def build_embedding_shards(texts, shard_dir, batch_size=32, num_workers=2, shard_size=2048):
+    _shard_manifest(shard_dir, texts, shard_size)
+
+    shard_paths = []
+    pending = []
+    for shard_id, start in enumerate(range(0, len(texts), shard_size)):
+        shard_path = os.path.join(shard_dir, f'shard_{shard_id:05d}.npy')
+        shard_paths.append(shard_path)
+        if not os.path.exists(shard_path):
+            pending.append((shard_path, texts[start:start + shard_size], batch_size))
+    print(f"{len(shard_paths) - len(pending)}/{len(shard_paths)} shard đã có, còn {len(pending)} shard cần embedding")
+
+    if pending:
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        ctx = mp.get_context('spawn')
+        with ctx.Pool(num_workers, initializer=_init_worker, initargs=(num_threads,)) as pool:
+            for _ in tqdm(pool.imap_unordered(_embed_shard, pending), total=len(pending), desc="Embedding shards"):
+                pass
+
+    return np.concatenate([np.load(path) for path in shard_paths]) if shard_paths \
+        else np.zeros((0, get_model('embedding').dimension), dtype=np.float32)
+
+def _tokenizer():
+    # build nhiều process: model chỉ load trong worker, process cha chỉ cần tokenizer để đếm token
+    # (không load cả model / không export onnx chỉ vì tokenizer)
+    if is_loaded('embedding'):
+        return get_model('embedding').tokenizer
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+
+def save_embedding(file_path, file_index, batch_size=32, num_workers=1, shard_size=2048, shard_dir=None,
+                   index_type=INDEX_TYPE):
     os.makedirs(os.path.dirname(file_index), exist_ok=True)
     
     with open(file_path, 'r', encoding='utf-8') as f:
         chunks = json.load(f)
     
-    all_embeddings = []
-    for chunk in tqdm(chunks, desc="Creating embeddings"):
-        text = get_embedding(chunk)
-        if text:
-            embedding = vietnamese_embedding(text)
-            all_embeddings.append(embedding)
+    texts = [get_embedding(chunk) for chunk in chunks]
+    texts = [text for text in texts if text]
+    if num_workers > 1 or shard_dir:
+        shard_dir = shard_dir or file_index + '.shards'
+        embeddings_array = build_embedding_shards(texts, shard_dir, batch_size, max(1, num_workers), shard_size)
+    else:
+        embeddings_array = vietnamese_embedding_batch(texts, batch_size=batch_size)
+    print(f"Tạo {len(embeddings_array)} embeddings")
     
-    embeddings_array = np.array(all_embeddings)
-    print(f"Tạo {len(all_embeddings)} embeddings")
-    
-    dimension = embeddings_array.shape[1]
-    # print(f"Dimension của embedding: {dimension}")
-    index = faiss.IndexFlatIP(dimension)
-    index.add(embeddings_array)
-    faiss.write_index(index, file_index)
+    # số token của từng chunk cho retrieve(), ghi trước index để Retriever reload thấy bản mới
+    update_token_counts(chunks, file_path, _tokenizer())
+    load_or_build_bm25(chunks, file_path)
+    write_chunk_store(chunks, chunk_store_file(file_path))
+
+    # print(f"Dimension của embedding: {embeddings_array.shape[1]}")
+    index = build_index(embeddings_array, index_type)
+    print(f"Build index {index_type}: {index.ntotal} vectors")
+    if index_type in COMPRESSED_INDEX_TYPES:
+        # index chỉ giữ vector nén -> giữ bản float32 trên đĩa để Retriever chấm lại top ứng viên
+        save_vectors(embeddings_array, vectors_file(file_index))
+    elif os.path.exists(vectors_file(file_index)):
+        os.remove(vectors_file(file_index))
+    # ghi ra file tạm rồi rename để Retriever không bao giờ đọc phải file ghi dở
+    tmp_index = file_index + '.tmp'
+    faiss.write_index(index, tmp_index)
+    os.replace(tmp_index, file_index)
+
+    # index đã ghi xong -> không cần giữ shard nữa
+    if shard_dir and os.path.isdir(shard_dir):
+        shutil.rmtree(shard_dir)
 
 if __name__ == '__main__':
-    input_file = 'data/Chunk.json'
-    file_index = 'src/database/faiss.index'
-    save_embedding(input_file, file_index)  
+    input_file = CHUNK_FILE
+    file_index = INDEX_FILE
+    batch_size = int(os.getenv('EMBED_BATCH_SIZE', 32))
+    num_workers = int(os.getenv('EMBED_WORKERS', 1))
+    save_embedding(input_file, file_index, batch_size=batch_size, num_workers=num_workers)
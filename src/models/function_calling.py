@@ -1,14 +1,17 @@
 from typing import Optional, Dict, Any
 import json
-from langchain_community.llms.ollama import Ollama
 import re
 import uuid
 from datetime import datetime
 import os
 import sys
+import threading
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 from src.utils.chat_history import message_history, get_history, delete_history
+from src.models.intent_router import IntentRouter, ROUTE_NONE
+from src.models.ollama_client import get_llm
+from src.utils.config import INTENT_ROUTER_ENABLED, INTENT_NONE_THRESHOLD, FC_HISTORY_TOKENS, FC_MESSAGE_TOKENS
 
 TOOLS = [
     {
@@ -140,6 +143,9 @@ TOOLS = [
     }
 ]
 
+# router cục bộ: câu hỏi rõ ràng không cần tool thì không gọi LLM function calling
+intent_router = IntentRouter(TOOLS, INTENT_NONE_THRESHOLD) if INTENT_ROUTER_ENABLED else None
+
 def tinh_thoi_gian_thu_viec(job_type: str) -> str:
     periods = {"ky_thuat_cao": "60 ngày", "quan_ly": "60 ngày", "thuc_tap": "3 đến 6 tháng "}
     return periods.get(job_type, "30 ngày")
@@ -278,43 +284,38 @@ def extract_json_from_response(response: str) -> Optional[Dict[str, Any]]:
         print("Response gốc:", response)
         return None
 
-def process_query(query: str, user_id: str = None) -> Optional[str]:
-    try:
-        llm = Ollama(
-            model="llama3.1:8b",  
-            temperature=0.1,      
-            top_k=10,
-            top_p=0.9,
-            repeat_penalty=1.1,
-            num_ctx=4096,
-            stop=['Question:', 'Câu hỏi:', 'Human:', 'Assistant:', '```']
-        )        
-        if not user_id:
-            user_id = str(uuid.uuid4())
-            
-        history = get_history(user_id)
-        prompt = f'''Bạn là một luật sư chuyên nghiệp tại Việt Nam, hỗ trợ tính toán, phân tích và tra cứu quy định lao động.
+# ------------ prompt function calling ------------
+def render_tools(tools) -> str:
+    """
+    Mô tả tool gọn, mỗi tool 1 dòng thay cho json.dumps(indent=2):
+    ten_ham(tham_so*: kiểu [enum]; ...): mô tả      (* = bắt buộc)
+    """
+    lines = []
+    for tool in tools:
+        params = tool.get("parameters", {})
+        required = set(params.get("required", []))
+        args = []
+        for name, spec in params.get("properties", {}).items():
+            arg = f"{name}{'*' if name in required else ''}: {spec.get('type', 'string')}"
+            if spec.get("enum"):
+                arg += f" [{'|'.join(spec['enum'])}]"
+            args.append(arg)
+        lines.append(f"- {tool['name']}({'; '.join(args)}): {tool['description']}")
+    return "\n".join(lines)
 
-NHIỆM VỤ CỦA BẠN:
-Phân tích câu hỏi và trả về chính xác JSON theo định dạng sau, không thêm bất kỳ text nào khác:
+TOOLS_PROMPT = render_tools(TOOLS)
 
-{{
-    "function": "<tên_hàm>",
-    "arguments": {{<tham_số_hàm>}},
-    "missing_info": ["<danh_sách_tham_số_thiếu>"]
-}}
+# Phần đầu prompt không đổi giữa các request -> Ollama dùng lại KV-cache của prefix,
+# chỉ phải prefill phần lịch sử + câu hỏi phía sau
+PROMPT_PREFIX = f'''Bạn là một luật sư chuyên nghiệp tại Việt Nam, hỗ trợ tính toán, phân tích và tra cứu quy định lao động.
 
-QUY TẮC NGHIÊM NGẶT:
-1. CHỈ TRẢ VỀ MỘT JSON DUY NHẤT
-2. KHÔNG THÊM TEXT GIẢI THÍCH
-3. KHÔNG THÊM MARKDOWN
-4. KHÔNG THÊM NEWLINE
-5. KHÔNG THÊM KHOẢNG TRẮNG THỪA
+NHIỆM VỤ: Phân tích câu hỏi và CHỈ trả về MỘT JSON trên một dòng, không giải thích, không markdown:
+{{"function": "<tên_hàm>", "arguments": {{<tham_số_hàm>}}, "missing_info": ["<tham_số_thiếu>"]}}
 
 LOGIC XỬ LÝ:
-- Nếu đủ thông tin để gọi hàm: điền "function" và "arguments", để "missing_info": []
-- Nếu thiếu thông tin: điền "function", để "arguments": {{}}, điền "missing_info" với danh sách tham số thiếu
-- Nếu không xác định được hàm hoặc câu hỏi không liên quan đến tính toán/tra cứu: trả về {{"function": "Not_call_function_calling", "arguments": {{}}, "missing_info": []}}
+- Đủ thông tin: điền "function" và "arguments", "missing_info": []
+- Thiếu thông tin: điền "function", "arguments": {{}}, liệt kê tham số thiếu trong "missing_info"
+- Không xác định được hàm hoặc không phải câu hỏi tính toán/tra cứu: {{"function": "Not_call_function_calling", "arguments": {{}}, "missing_info": []}}
 
 ÁNH XẠ TỪ KHÓA:
 - 'kỹ thuật cao', 'kỹ sư' -> 'ky_thuat_cao'
@@ -322,16 +323,90 @@ LOGIC XỬ LÝ:
 - 'ngày chủ nhật','cuối tuần' -> 'ngay_nghi'
 - 'Tết', 'Quốc Khánh' -> 'ngay_le'
 
-CÁC HÀM CÓ THỂ GỌI:
-{json.dumps(TOOLS, ensure_ascii=False, indent=2)}
+CÁC HÀM CÓ THỂ GỌI (* = bắt buộc):
+{TOOLS_PROMPT}
+'''
 
-Câu hỏi: {query}
+def approx_tokens(text: str) -> int:
+    # ước lượng nhanh cho tiếng Việt với tokenizer llama (~3 ký tự / token), chỉ dùng để chia ngân sách
+    return len(text) // 3 + 1
 
+def format_history(history, budget: int = FC_HISTORY_TOKENS, message_tokens: int = FC_MESSAGE_TOKENS) -> str:
+    """
+    Giữ các tin nhắn gần nhất trong ngân sách token, tin nhắn dài bị cắt bớt,
+    phần cũ hơn chỉ ghi lại số tin nhắn đã lược bỏ
+    """
+    lines = []
+    used = 0
+    for i, msg in enumerate(reversed(history)):
+        content = " ".join(str(msg.get("content", "")).split())
+        if approx_tokens(content) > message_tokens:
+            content = content[:message_tokens * 3] + "..."
+        line = f"{msg.get('role', 'user')}: {content}"
+        cost = approx_tokens(line)
+        if used + cost > budget:
+            lines.append(f"(đã lược bỏ {len(history) - i} tin nhắn cũ hơn)")
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join(reversed(lines)) if lines else "(trống)"
+
+def build_prompt(query: str, history) -> str:
+    # lịch sử đặt trước câu hỏi để phần dùng chung với lượt trước càng dài càng tốt
+    return f"""{PROMPT_PREFIX}
 Lịch sử trao đổi:
-{history}'''
+{format_history(history)}
+
+Câu hỏi: {query}
+JSON:"""
+
+'''thống kê số token prompt mỗi request (theo prompt_eval_count Ollama trả về)'''
+_prompt_stats = {"calls": 0, "prompt_tokens": 0, "prompt_chars": 0, "prompt_eval_ms": 0.0, "last": None}
+_prompt_stats_lock = threading.Lock()     # ghi từ nhiều thread (asyncio.to_thread, pipeline)
+
+def record_prompt_stats(prompt: str, output: Dict[str, Any]):
+    # prompt_eval_count chỉ đếm token thực sự phải prefill, phần prefix đã cache sẽ không tính
+    tokens = output.get("prompt_eval_count", 0)
+    eval_ms = output.get("prompt_eval_duration", 0) / 1e6
+    with _prompt_stats_lock:
+        _prompt_stats["calls"] += 1
+        _prompt_stats["prompt_tokens"] += tokens
+        _prompt_stats["prompt_chars"] += len(prompt)
+        _prompt_stats["prompt_eval_ms"] += eval_ms
+        _prompt_stats["last"] = {"prompt_tokens": tokens, "prompt_chars": len(prompt), "prompt_eval_ms": round(eval_ms, 1)}
+    print(f"DEBUG LLM PROMPT: {len(prompt)} ký tự, prefill {tokens} token, {eval_ms:.0f} ms")
+
+def prompt_stats() -> Dict[str, Any]:
+    with _prompt_stats_lock:
+        stats = dict(_prompt_stats)
+    calls = stats["calls"]
+    return {
+        "calls": calls,
+        "prefix_tokens_est": approx_tokens(PROMPT_PREFIX),
+        "avg_prompt_tokens": round(stats["prompt_tokens"] / calls, 1) if calls else 0.0,
+        "avg_prompt_chars": round(stats["prompt_chars"] / calls, 1) if calls else 0.0,
+        "avg_prompt_eval_ms": round(stats["prompt_eval_ms"] / calls, 1) if calls else 0.0,
+        "last": stats["last"],
+    }
+
+def process_query(query: str, user_id: str = None) -> Optional[str]:
+    try:
+        if not user_id:
+            user_id = str(uuid.uuid4())
+            
+        history = get_history(user_id)
+        if intent_router is not None:
+            decision = intent_router.route(query, history)
+            if decision.route == ROUTE_NONE:
+                print(f"DEBUG ROUTER: bỏ qua function calling (similarity {decision.score:.3f})")
+                return None
+
+        llm = get_llm('router')     # client dùng chung, giữ kết nối tới Ollama
+        prompt = build_prompt(query, history)
 
-        print("DEBUG LLM PROMPT:", prompt)
-        response = llm.invoke(prompt)
+        output = llm.generate(prompt)
+        response = output['response']
+        record_prompt_stats(prompt, output)
         print("DEBUG LLM RESPONSE:", response)
 
         result = extract_json_from_response(response)
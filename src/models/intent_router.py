@@ -0,0 +1,148 @@
+import re
+import logging
+import threading
+from collections import namedtuple, Counter
+import numpy as np
+from unidecode import unidecode
+
+logger = logging.getLogger(__name__)
+
+'''
+Router cục bộ chạy trước LLM function calling:
+1. keyword/regex theo context_requirements của từng tool (không dấu, không phân biệt hoa thường)
+2. nearest-neighbour giữa embedding câu hỏi và embedding mô tả tool
+Câu hỏi không khớp keyword và không gần tool nào -> "none", không cần gọi llama3.1:8b.
+'''
+ROUTE_TOOL = 'tool'             # khớp keyword -> chắc chắn cần LLM function calling
+ROUTE_UNCERTAIN = 'uncertain'   # gần mô tả tool -> để LLM quyết định
+ROUTE_NONE = 'none'             # không liên quan tool -> bỏ qua LLM function calling
+
+RouteDecision = namedtuple('RouteDecision', ['route', 'tool', 'score', 'reason'])
+
+# cách hỏi thường gặp không nằm trong context_requirements
+EXTRA_PATTERNS = {
+    'tinh_thoi_gian_thu_viec': [r'thu viec (bao lau|may thang|toi da)'],
+    'tra_cuu_luong_toi_thieu': [r'luong (toi thieu|co ban) vung', r'muc luong toi thieu'],
+    'kiem_tra_gio_lam_them': [r'lam them (bao nhieu|toi da|qua) ?(gio)?', r'gioi han (gio )?lam them'],
+    'tinh_luong_thuc_nhan': [r'luong (gross|net)', r'thuc (nhan|linh)'],
+    'tinh_ngay_phep_nam': [r'(bao nhieu|may) ngay phep', r'ngay nghi phep'],
+    'tinh_luong_lam_them': [r'(tien|luong) (tang ca|lam them|ot)\b'],
+    'kiem_tra_dieu_kien_nghi_viec_hop_phap': [r'(nghi|thoi) viec.*(bao truoc|hop phap)'],
+    'tinh_luong_ngay_nghi_le_tet': [r'lam\b.{0,15}\bngay (le|tet)\b', r'lam\b.{0,15}\btet\b'],
+    'kiem_tra_dieu_kien_nghi_om_huong_bhxh': [r'(om|benh).*(bhxh|bao hiem)'],
+}
+
+# câu hỏi lại khi thiếu tham số (xem process_query) -> câu tiếp theo của user là câu trả lời cho tool
+FOLLOW_UP_PREFIX = 'Bạn có thể cho tôi biết'
+
+def fold_text(text):
+    return re.sub(r'\s+', ' ', unidecode(text).lower()).strip()
+
+class IntentRouter:
+    def __init__(self, tools, none_threshold=0.5, embed_fn=None, embed_batch_fn=None):
+        self.tools = tools
+        self.none_threshold = none_threshold
+        self.embed_fn = embed_fn
+        self.embed_batch_fn = embed_batch_fn
+        self.patterns = []
+        for tool in tools:
+            alternatives = [re.escape(fold_text(k)) for k in tool.get('context_requirements', [])]
+            alternatives += EXTRA_PATTERNS.get(tool['name'], [])
+            if alternatives:
+                self.patterns.append((tool['name'], re.compile(r'\b(?:' + '|'.join(alternatives) + r')')))
+        self._matrix = None             # embedding mô tả tool, mỗi dòng 1 câu
+        self._labels = None             # tên tool của từng dòng
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _embed(self, text):
+        if self.embed_fn is None:
+            from src.retrieval.query import get_vietnamese_embedding     # load model khi thật sự cần
+            self.embed_fn = get_vietnamese_embedding
+        return np.asarray(self.embed_fn(text), dtype=np.float32)
+
+    def _embed_batch(self, texts):
+        '''mô tả tool: embed 1 lần cả batch, không đi qua cache câu hỏi (LRU + Redis)'''
+        if self.embed_batch_fn is not None:
+            return np.asarray(self.embed_batch_fn(texts), dtype=np.float32)
+        if self.embed_fn is not None:
+            return np.stack([self._embed(text) for text in texts])
+        from src.models.registry import get_model
+        return np.asarray(get_model('embedding').encode(texts, batch_size=32, max_length=512), dtype=np.float32)
+
+    def _tool_matrix(self):
+        if self._matrix is None:
+            with self._lock:
+                if self._matrix is None:
+                    texts, labels = [], []
+                    for tool in self.tools:
+                        for text in [tool['description']] + tool.get('context_requirements', []):
+                            texts.append(text)
+                            labels.append(tool['name'])
+                    self._labels = labels
+                    self._matrix = self._embed_batch(texts)
+        return self._matrix, self._labels
+
+    def match_keyword(self, query):
+        folded = fold_text(query)
+        for name, pattern in self.patterns:
+            if pattern.search(folded):
+                return name
+        return None
+
+    def route(self, query, history=None):
+        # câu trả lời gần nhất của bot là câu hỏi lại tham số -> câu này đang bổ sung thông tin cho tool
+        last_reply = next((m for m in reversed(history or []) if m.get('role') == 'assistant'), None)
+        if last_reply and last_reply.get('content', '').startswith(FOLLOW_UP_PREFIX):
+            return self._count(RouteDecision(ROUTE_UNCERTAIN, None, 1.0, 'follow_up'))
+
+        tool = self.match_keyword(query)
+        if tool is not None:
+            return self._count(RouteDecision(ROUTE_TOOL, tool, 1.0, 'keyword'))
+
+        matrix, labels = self._tool_matrix()
+        similarities = matrix @ self._embed(query)
+        best = int(np.argmax(similarities))
+        score = float(similarities[best])
+        if score >= self.none_threshold:
+            return self._count(RouteDecision(ROUTE_UNCERTAIN, labels[best], score, 'embedding'))
+        return self._count(RouteDecision(ROUTE_NONE, None, score, 'embedding'))
+
+    def _count(self, decision):
+        self.counts[decision.route] += 1
+        return decision
+
+    def stats(self):
+        total = sum(self.counts.values())
+        return {
+            'routes': dict(self.counts),
+            'skip_rate': self.counts[ROUTE_NONE] / total if total else 0.0,
+            'none_threshold': self.none_threshold,
+        }
+
+'''precision / recall trên tập có nhãn: positive = câu hỏi cần tool, dự đoán positive = không bị router bỏ qua'''
+def evaluate(router, examples):
+    tp = fp = fn = tn = 0
+    errors = []
+    for example in examples:
+        needs_tool = example.get('tool') is not None
+        decision = router.route(example['query'])
+        sent_to_llm = decision.route != ROUTE_NONE
+        if needs_tool and sent_to_llm:
+            tp += 1
+        elif needs_tool:
+            fn += 1
+            errors.append((example['query'], example.get('tool'), decision))
+        elif sent_to_llm:
+            fp += 1
+            errors.append((example['query'], None, decision))
+        else:
+            tn += 1
+    total = tp + fp + fn + tn
+    return {
+        'precision': tp / (tp + fp) if tp + fp else 0.0,
+        'recall': tp / (tp + fn) if tp + fn else 0.0,
+        'skip_rate': (fn + tn) / total if total else 0.0,
+        'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+        'errors': errors,
+    }
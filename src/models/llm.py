@@ -1,4 +1,3 @@
-from langchain_community.llms.ollama import Ollama
 import sys
 import os
 import time
@@ -8,27 +7,16 @@ import json
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 from src.utils.chat_history import message_history, get_history
-from src.models.function_calling import process_query
-from src.retrieval.query import retrieve
+from src.models.pipeline import route_and_retrieve
+from src.models.ollama_client import get_llm
+from src.retrieval.context_packer import Passage, pack_context
+from src.models import registry
+from src.utils.config import CONTEXT_TOKEN_BUDGET, MODEL_WARMUP
 
-print('Đang kết nối Mistral-7B...')
-try:
-    llm = Ollama(
-        model="mistral:7b",  
-        temperature=0.1,     # Giảm temperature để output nhất quán hơn
-        top_k=10,
-        top_p=0.9,
-        repeat_penalty=1.1,
-        num_ctx=4096,  
-        stop=['Question:', 'Câu hỏi:', 'Human:', 'Assistant:']
-    )
-    print('Kết nối Ollama thành công')
-except Exception as e:
-    print(f'Lỗi kết nối Ollama: {str(e)}')
-    sys.exit(1)
+llm = get_llm('answer')
 
 ### -------------------prompt template -------------------
-def prompt_template(query, context, n_context=10):
+def prompt_template(query, context, n_context=10, token_budget=CONTEXT_TOKEN_BUDGET):
     prompt = """Bạn là một luật sư chuyên nghiệp người Việt Nam. Hãy trả lời câu hỏi dựa trên các nội dung pháp luật được cung cấp.
     YÊU CẦU:
     1. LUÔN trả lời bằng tiếng Việt
@@ -39,6 +27,9 @@ def prompt_template(query, context, n_context=10):
     
     prompt += "\nNội dung pháp luật được trích xuất:\n"
     
+    # Passage (có số token, Điều) -> đóng gói theo ngân sách token; text thường -> giữ như cũ
+    if context and isinstance(context[0], Passage):
+        context = pack_context(context, token_budget, n_context)
     for i, c in enumerate(context[:n_context], 1): 
         if isinstance(c, dict):
             c = c['answer']
@@ -50,25 +41,27 @@ def prompt_template(query, context, n_context=10):
 
 ### -------------------llm -------------------
 def main():
+    if MODEL_WARMUP:
+        # load model trong lúc người dùng đang gõ câu hỏi
+        registry.warmup(extra=[llm.warmup, get_llm('router').warmup])
     query = input('Nhập câu hỏi: ')
-    try:
-        print("\nĐang phân tích câu hỏi...")
-        # Tạo một session_id tạm thời cho CLI
-        temp_session_id = f"cli_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        function_result = process_query(query, temp_session_id)
-        
-        if function_result:
-            print('\nAnswer:')
-            print(function_result)
-            return
-                
-    except Exception as e:
-        print(f"Lỗi khi tra cứu thông tin: {str(e)}")
-    
-    print("\nĐang tìm kiếm thông tin liên quan...")
+    # Tạo một session_id tạm thời cho CLI
+    temp_session_id = f"cli_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+    # function calling và retrieval chạy song song
+    print("\nĐang phân tích câu hỏi và tìm kiếm thông tin liên quan...")
     retrieval_start = time.time()
-    context, scores, retrieval_time, total_tokens = retrieve(query)
-    retrieval_end = time.time()
+    function_result, retrieval = route_and_retrieve(query, temp_session_id)
+
+    if function_result:
+        print('\nAnswer:')
+        print(function_result)
+        return
+    if retrieval.cached_answer is not None:
+        print('\nAnswer:')
+        print(retrieval.cached_answer)
+        return
+    context, scores = retrieval.context, retrieval.scores
 
     print("\nĐiểm số các đoạn văn bản:")
     for i, (c, s) in enumerate(zip(context[:10], scores[:10]), 1):
@@ -76,7 +69,7 @@ def main():
             c = c['answer']
         print(f"Đoạn {i}: {s:.4f}")
 
-    prompt = prompt_template(query, context)
+    prompt = prompt_template(query, retrieval.passages)
     try:
         print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Đang tạo câu trả lời từ Mistral-7B...")
         
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.config import OLLAMA_BASE_URL, OLLAMA_TIMEOUT, LLM_CONFIGS
+
+'''
+Client gọi thẳng Ollama /api/generate, giữ connection pool keep-alive:
+- sync: requests.Session (gradio, cli, function calling)
+- async: httpx.AsyncClient (FastAPI)
+'''
+class OllamaClient:
+    def __init__(self, model, base_url=OLLAMA_BASE_URL, timeout=OLLAMA_TIMEOUT, stop=None,
+                 max_connections=20, keep_alive=None, **options):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.stop = stop or []
+        self.options = options          # temperature, top_k, top_p, repeat_penalty, num_ctx, ...
+        self.keep_alive = keep_alive    # thời gian Ollama giữ model trong RAM, vd "30m"
+        self.max_connections = max_connections
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._client = None
+
+    # ------------ sync ------------
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _payload(self, prompt, stream=False):
+        options = dict(self.options)
+        if self.stop:
+            options['stop'] = self.stop
+        payload = {'model': self.model, 'prompt': prompt, 'stream': stream, 'options': options}
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+        return payload
+
+    @staticmethod
+    def _parse_line(line):
+        data = json.loads(line)
+        if data.get('error'):
+            raise RuntimeError(data['error'])
+        return data
+
+    def generate(self, prompt):
+        '''-> response json đầy đủ của Ollama (response, prompt_eval_count, eval_count, ...)'''
+        response = self.session.post(f'{self.base_url}/api/generate', json=self._payload(prompt),
+                                     timeout=(5.0, self.timeout))
+        response.raise_for_status()
+        return self._parse_line(response.content)
+
+    def invoke(self, prompt):
+        return self.generate(prompt)['response']
+
+    def warmup(self):
+        '''request không có prompt -> Ollama chỉ nạp model vào RAM/VRAM, request đầu tiên không phải chờ load'''
+        payload = {'model': self.model}
+        if self.keep_alive is not None:
+            payload['keep_alive'] = self.keep_alive
+        response = self.session.post(f'{self.base_url}/api/generate', json=payload, timeout=(5.0, self.timeout))
+        response.raise_for_status()
+
+    def stream(self, prompt):
+        '''yield từng đoạn text ngay khi Ollama sinh ra (NDJSON, stream=true)'''
+        with self.session.post(f'{self.base_url}/api/generate', json=self._payload(prompt, stream=True),
+                               timeout=(5.0, self.timeout), stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = self._parse_line(line)
+                if data.get('response'):
+                    yield data['response']
+                if data.get('done'):
+                    break
+
+    # ------------ async ------------
+    @property
+    def client(self):
+        # tạo trong event loop đang chạy, dùng lại cho mọi request
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def agenerate(self, prompt):
+        response = await self.client.post('/api/generate', json=self._payload(prompt))
+        response.raise_for_status()
+        return self._parse_line(response.content)
+
+    async def ainvoke(self, prompt):
+        return (await self.agenerate(prompt))['response']
+
+    async def astream(self, prompt):
+        async with self.client.stream('POST', '/api/generate', json=self._payload(prompt, stream=True)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                data = self._parse_line(line)
+                if data.get('response'):
+                    yield data['response']
+                if data.get('done'):
+                    break
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+'''registry: mỗi cấu hình (router / answer / chat) 1 client dùng chung trong process'''
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_llm(name):
+    with _clients_lock:
+        if name not in _clients:
+            if name not in LLM_CONFIGS:
+                raise KeyError(f"Không có cấu hình LLM '{name}' (có: {', '.join(LLM_CONFIGS)})")
+            _clients[name] = OllamaClient(**LLM_CONFIGS[name])
+        return _clients[name]
+
+def close_all():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+
+async def aclose_all():
+    for client in list(_clients.values()):
+        await client.aclose()
@@ -0,0 +1,78 @@
+import os
+import sys
+import asyncio
+import threading
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.models.function_calling import process_query
+from src.retrieval.query import retrieve_passages
+from src.retrieval.semantic_cache import answer_cache
+from src.utils.config import PIPELINE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+'''
+Function calling (llama3.1:8b) và retrieval (semantic cache -> faiss -> rerank) chạy song song.
+Function calling trả về kết quả -> huỷ nhánh retrieval; ngược lại dùng kết quả retrieval đã chạy sẵn.
+'''
+# cached_answer: câu trả lời lấy từ semantic cache (None nếu phải gọi LLM)
+# passages: chunk kèm Điều / vị trí / số token, dùng để đóng gói context vào prompt
+RetrievalResult = namedtuple('RetrievalResult', ['cached_answer', 'context', 'scores', 'retrieval_time', 'total_tokens', 'passages'])
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='retrieval')
+
+def retrieval_branch(query, cancel_event=None):
+    # câu hỏi nhắc thẳng Điều / Chương -> lookup bỏ qua semantic cache, retrieve tra trực tiếp
+    cached = answer_cache.lookup(query)
+    if cached is not None:
+        answer, context = cached
+        return RetrievalResult(answer, context, [], 0.0, 0, [])
+    # không ghi data/retrieval.json: nhiều request song song cùng ghi 1 file
+    passages, retrieval_time, total_tokens = retrieve_passages(query, output_file=None, cancel_event=cancel_event)
+    return RetrievalResult(None, [p.answer for p in passages], [p.score for p in passages],
+                           retrieval_time, total_tokens, passages)
+
+def _route(query, session_id):
+    try:
+        return process_query(query, session_id)
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý function calling: {str(e)}")
+        return None
+
+def route_and_retrieve(query, session_id):
+    '''-> (function_result, None) hoặc (None, RetrievalResult)'''
+    cancel_event = threading.Event()
+    retrieval_future = _executor.submit(retrieval_branch, query, cancel_event)
+
+    function_result = _route(query, session_id)
+    if function_result is not None:
+        cancel_event.set()
+        retrieval_future.cancel()
+        return function_result, None
+    return None, retrieval_future.result()
+
+async def aroute_and_retrieve(query, session_id, run_model=None):
+    '''bản async cho FastAPI; run_model: hàm đẩy việc CPU sang executor của api'''
+    cancel_event = threading.Event()
+    if run_model is None:
+        loop = asyncio.get_running_loop()
+        retrieval_task = asyncio.ensure_future(loop.run_in_executor(_executor, retrieval_branch, query, cancel_event))
+    else:
+        retrieval_task = asyncio.ensure_future(run_model(retrieval_branch, query, cancel_event))
+
+    try:
+        function_result = await asyncio.to_thread(_route, query, session_id)
+    except BaseException:
+        cancel_event.set()
+        retrieval_task.cancel()
+        raise
+
+    if function_result is not None:
+        cancel_event.set()
+        retrieval_task.cancel()
+        return function_result, None
+    return None, await retrieval_task
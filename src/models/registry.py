@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import logging
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.config import (
+    EMBEDDING_MODEL_NAME, RERANKER_MODEL_NAME, EMBEDDING_BACKEND, RERANKER_BACKEND,
+    RERANKER_HEAVY_MODEL_NAME, RERANK_CASCADE_ENABLED
+)
+
+logger = logging.getLogger(__name__)
+
+'''
+Registry model dùng chung trong process:
+- chỉ load khi get_model() lần đầu (import module không tốn thời gian load model)
+- mỗi model 1 bản cho mọi module (query, vn_embedder, intent_router, ...)
+- warmup(): load trước trên thread nền sau khi server đã khởi động
+'''
+
+class LazyModel:
+    def __init__(self, name, loader, preload=True):
+        self.name = name
+        self.loader = loader
+        self.preload = preload          # False: warmup() mặc định bỏ qua, chỉ load khi get_model() lần đầu
+        self.load_time = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    value = self.loader()
+                    self.load_time = time.perf_counter() - start
+                    logger.info(f"Loaded model '{self.name}' trong {self.load_time:.2f}s")
+                    self._value = value
+        return self._value
+
+'''loader: import thư viện nặng (torch, transformers, sentence_transformers) bên trong'''
+def _load_embedding():
+    # TorchEmbedder hoặc OnnxEmbedder: .tokenizer, .dimension, .encode(texts)
+    from src.embeddings.backends import load_embedder
+    return load_embedder(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+
+def _load_reranker():
+    # CrossEncoder hoặc OnnxCrossEncoder, cùng predict(pairs)
+    from src.retrieval.rerank_backends import load_reranker
+    return load_reranker(RERANKER_MODEL_NAME, RERANKER_BACKEND)
+
+def _load_heavy_reranker():
+    # bge-reranker-v2-m3: chỉ dùng khi reranker nhẹ không phân định được (src/retrieval/adaptive_rerank.py)
+    from src.retrieval.rerank_backends import load_reranker
+    return load_reranker(RERANKER_HEAVY_MODEL_NAME, RERANKER_BACKEND)
+
+_models = {}
+_models_lock = threading.Lock()
+
+def register(name, loader, preload=True):
+    with _models_lock:
+        if name not in _models:
+            _models[name] = LazyModel(name, loader, preload)
+        return _models[name]
+
+register('embedding', _load_embedding)
+register('reranker', _load_reranker)
+if RERANK_CASCADE_ENABLED:
+    # ~2GB, đa số request không cần -> không load sẵn lúc khởi động
+    register('reranker-heavy', _load_heavy_reranker, preload=False)
+
+def get_model(name):
+    if name not in _models:
+        raise KeyError(f"Không có model '{name}' (có: {', '.join(_models)})")
+    return _models[name].get()
+
+def is_loaded(name):
+    return name in _models and _models[name].loaded
+
+def warmup(names=None, extra=(), background=True):
+    '''load các model (mặc định tất cả model preload=True) + chạy thêm các hàm warmup khác (vd. nạp model Ollama)'''
+    def run():
+        start = time.perf_counter()
+        for name in names or [name for name, model in _models.items() if model.preload]:
+            try:
+                get_model(name)
+            except Exception as e:
+                logger.error(f"Warmup model '{name}' lỗi: {str(e)}")
+        for fn in extra:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Warmup lỗi: {str(e)}")
+        logger.info(f"Warmup xong trong {time.perf_counter() - start:.2f}s")
+
+    if not background:
+        run()
+        return None
+    thread = threading.Thread(target=run, name='model-warmup', daemon=True)
+    thread.start()
+    return thread
+
+def stats():
+    return {name: {'loaded': m.loaded, 'load_time': m.load_time} for name, m in _models.items()}
@@ -0,0 +1,140 @@
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+Rerank thích ứng, 3 nhánh:
+- skip:    điểm dense top-1 vượt top-2 một khoảng >= skip_margin -> giữ thứ tự dense, không chạy cross-encoder
+- cheap:   chỉ rerank top_n ứng viên đầu bằng reranker nhẹ (MiniLM), phần sau giữ thứ tự cũ
+- cascade: reranker nhẹ không phân định được (margin < cascade_margin) -> chấm thêm bằng reranker nặng
+           (bge-reranker-v2-m3) trên cùng top_n, điểm = tổng có trọng số
+Điểm trả về (bật hay tắt) là điểm fuse của chính chunk đó (RRF, hoặc cosine faiss khi không có BM25):
+cùng 1 thang cho mọi nhánh; điểm cross-encoder chỉ dùng để sắp xếp, nên sau rerank điểm không nhất thiết giảm dần.
+Mỗi nhánh ghi latency; audit_rate: tỉ lệ request được chấm lại đầy đủ (mọi ứng viên, mọi model)
+trên thread nền để đo độ khớp top-1 của từng nhánh so với rerank đầy đủ.
+'''
+PATH_SKIP = 'skip'
+PATH_CHEAP = 'cheap'
+PATH_CASCADE = 'cascade'
+
+def _margin(scores):
+    if len(scores) < 2:
+        return float('inf')
+    top2 = np.sort(np.asarray(scores, dtype=np.float32))[-2:]
+    return float(top2[1] - top2[0])
+
+class AdaptiveReranker:
+    def __init__(self, cheap, heavy=None, score_cache=None, skip_margin=0.1, top_n=5, cascade_margin=0.2,
+                 audit_rate=0.0, enabled=True):
+        self.cheap = cheap              # (BatchingReranker, weight)
+        self.heavy = heavy              # (BatchingReranker, weight) hoặc None = không cascade
+        self.score_cache = score_cache  # TTLCache điểm (model, query, chunk)
+        self.skip_margin = skip_margin
+        self.top_n = top_n
+        self.cascade_margin = cascade_margin
+        self.audit_rate = audit_rate
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._paths = {path: {'count': 0, 'total_ms': 0.0, 'reranked': 0, 'audited': 0, 'top1_match': 0}
+                       for path in (PATH_SKIP, PATH_CHEAP, PATH_CASCADE)}
+        self._audit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rerank-audit')
+
+    def _score(self, model_idx, reranker, qkey, chunk_ids, pairs, idx):
+        '''điểm của reranker cho các ứng viên idx; cặp đã chấm thì lấy từ cache, chỉ predict cặp mới'''
+        keys = [(model_idx, qkey, chunk_ids[i]) for i in idx]
+        scores = [self.score_cache.get(key) if self.score_cache is not None else None for key in keys]
+        missing = [j for j, score in enumerate(scores) if score is None]
+        if missing:
+            new_scores = reranker.predict([pairs[idx[j]] for j in missing])
+            for j, score in zip(missing, new_scores):
+                scores[j] = float(score)
+                if self.score_cache is not None:
+                    self.score_cache.set(keys[j], scores[j])
+        return np.array(scores, dtype=np.float32)
+
+    def _full(self, qkey, chunk_ids, pairs):
+        '''rerank đầy đủ: mọi ứng viên, mọi model -> điểm tổng có trọng số'''
+        idx = list(range(len(pairs)))
+        models = [self.cheap] + ([self.heavy] if self.heavy is not None else [])
+        return sum(weight * self._score(i, reranker, qkey, chunk_ids, pairs, idx)
+                   for i, (reranker, weight) in enumerate(models))
+
+    def rerank(self, qkey, chunk_ids, pairs, dense_scores, fused_scores, dense_top):
+        '''
+        pairs: [query, chunk] theo thứ tự ứng viên (sau fuse); dense_scores: điểm faiss của dense top-k (giảm dần);
+        fused_scores: điểm fuse của từng ứng viên (cùng thứ tự pairs);
+        dense_top: ứng viên đầu tiên có phải top-1 của faiss không
+        -> (thứ tự chỉ số ứng viên, điểm fuse của từng ứng viên theo thứ tự đó, nhánh)
+        '''
+        start = time.perf_counter()
+        n = len(pairs)
+        if not self.enabled:
+            scores = self._full(qkey, chunk_ids, pairs) if self.heavy is not None else \
+                self._score(0, self.cheap[0], qkey, chunk_ids, pairs, list(range(n)))
+            order = np.argsort(-scores, kind='stable').tolist()
+            return order, [float(fused_scores[i]) for i in order], None
+
+        dense_margin = _margin(dense_scores)
+        if dense_top and dense_margin >= self.skip_margin:
+            path, order = PATH_SKIP, list(range(n))
+            reranked = 0
+            rerank_margin = None
+        else:
+            idx = list(range(min(self.top_n, n)))
+            reranker, weight = self.cheap
+            top_scores = self._score(0, reranker, qkey, chunk_ids, pairs, idx)
+            path = PATH_CHEAP
+            rerank_margin = _margin(top_scores)
+            if self.heavy is not None and rerank_margin < self.cascade_margin:
+                path = PATH_CASCADE
+                heavy_reranker, heavy_weight = self.heavy
+                top_scores = weight * top_scores + heavy_weight * self._score(1, heavy_reranker, qkey, chunk_ids, pairs, idx)
+            head = [idx[i] for i in np.argsort(-top_scores, kind='stable')]
+            # phần không rerank giữ thứ tự cũ
+            order = head + list(range(len(idx), n))
+            reranked = len(idx)
+        scores = [float(fused_scores[i]) for i in order]
+
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            stats = self._paths[path]
+            stats['count'] += 1
+            stats['total_ms'] += elapsed
+            stats['reranked'] += reranked
+        # rerank margin: margin của reranker nhẹ, dùng để chỉnh cascade_margin
+        logger.info(f"Rerank [{path}]: dense margin {dense_margin:.3f}, rerank margin "
+                    f"{'-' if rerank_margin is None else f'{rerank_margin:.3f}'}, rerank {reranked}/{n} ứng viên, {elapsed:.1f} ms")
+
+        if self.audit_rate and random.random() < self.audit_rate:
+            self._audit_executor.submit(self._audit, path, qkey, chunk_ids, pairs, order[0] if order else None)
+        return order, scores, path
+
+    def _audit(self, path, qkey, chunk_ids, pairs, top1):
+        try:
+            full = self._full(qkey, chunk_ids, pairs)
+        except Exception as e:
+            logger.error(f"Audit rerank lỗi: {str(e)}")
+            return
+        match = int(np.argmax(full)) == top1
+        with self._lock:
+            self._paths[path]['audited'] += 1
+            self._paths[path]['top1_match'] += int(match)
+        logger.info(f"Audit rerank [{path}]: top-1 {'khớp' if match else 'khác'} rerank đầy đủ")
+
+    def stats(self):
+        with self._lock:
+            return {
+                path: {
+                    'count': s['count'],
+                    'avg_ms': s['total_ms'] / s['count'] if s['count'] else 0.0,
+                    'avg_reranked': s['reranked'] / s['count'] if s['count'] else 0.0,
+                    'audited': s['audited'],
+                    'top1_agreement': s['top1_match'] / s['audited'] if s['audited'] else None,
+                }
+                for path, s in self._paths.items()
+            }
@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import logging
+from collections import Counter
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.data_processors.doc_chunking import chunk_id, chunk_answer
+from src.utils.config import BM25_K1, BM25_B
+
+logger = logging.getLogger(__name__)
+
+BM25_INDEX_VERSION = 1
+
+'''tách từ tiếng Việt bằng underthesea: "hợp đồng lao động" -> ["hợp_đồng", "lao_động"]'''
+def tokenize(text: str) -> list[str]:
+    from underthesea import word_tokenize      # import lần đầu khi cần, không làm chậm lúc khởi động
+    tokens = []
+    for token in word_tokenize(text.lower()):
+        token = token.replace(' ', '_')
+        if any(ch.isalnum() for ch in token):
+            tokens.append(token)
+    return tokens
+
+'''file inverted index lưu cạnh Chunk.json, giống .tokens.npz'''
+def bm25_index_file(chunk_file: str) -> str:
+    return os.path.splitext(chunk_file)[0] + '.bm25.npz'
+
+class BM25Index:
+    """
+    Inverted index BM25 dạng mảng (CSR):
+    postings của term t nằm ở doc_ids[offsets[t]:offsets[t + 1]], tần suất tương ứng trong tfs.
+    Lưu / load bằng np.savez, không pickle -> load nhanh lúc khởi động.
+    """
+    def __init__(self, terms, offsets, doc_ids, tfs, doc_lens, chunk_ids, k1=BM25_K1, b=BM25_B):
+        self.terms = terms
+        self.vocab = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.chunk_ids = chunk_ids
+        self.k1 = k1
+        self.b = b
+        n_docs = len(doc_lens)
+        df = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # phần mẫu số BM25 chỉ phụ thuộc độ dài doc -> tính 1 lần
+        avgdl = float(doc_lens.mean()) if n_docs else 1.0
+        self.length_norm = (k1 * (1 - b + b * doc_lens / max(avgdl, 1e-6))).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks: list[dict], **kwargs):
+        start = time.time()
+        postings = {}
+        doc_lens = np.zeros(len(chunks), dtype=np.int32)
+        for doc, chunk in enumerate(chunks):
+            tokens = tokenize(chunk_answer(chunk))
+            doc_lens[doc] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            docs, freqs = zip(*postings[term])
+            doc_ids[offsets[i]:offsets[i + 1]] = docs
+            tfs[offsets[i]:offsets[i + 1]] = np.minimum(freqs, np.iinfo(np.uint16).max)
+        chunk_ids = np.array([chunk_id(chunk) for chunk in chunks], dtype=np.int64)
+        logger.info(f"Build BM25: {len(chunks)} chunk, {len(terms)} term, {len(doc_ids)} posting ({time.time() - start:.1f}s)")
+        return cls(np.array(terms), offsets, doc_ids, tfs, doc_lens, chunk_ids, **kwargs)
+
+    def save(self, path: str) -> None:
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, version=np.array(BM25_INDEX_VERSION), terms=self.terms, offsets=self.offsets,
+                 doc_ids=self.doc_ids, tfs=self.tfs, doc_lens=self.doc_lens, chunk_ids=self.chunk_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data['version']) != BM25_INDEX_VERSION:
+                return None
+            return cls(data['terms'], data['offsets'], data['doc_ids'], data['tfs'],
+                       data['doc_lens'], data['chunk_ids'], **kwargs)
+
+    def matches(self, chunk_ids) -> bool:
+        '''index còn khớp với Chunk.json hiện tại không'''
+        return len(chunk_ids) == len(self.chunk_ids) and np.array_equal(self.chunk_ids, np.asarray(chunk_ids, dtype=np.int64))
+
+    def search(self, query: str, top_k: int = 10):
+        '''-> (vị trí trong Chunk.json, điểm BM25) giảm dần'''
+        scores = np.zeros(len(self.doc_lens), dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[t] * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return candidates.tolist(), scores[candidates].tolist()
+
+def load_or_build_bm25(chunks: list[dict], chunk_file: str, chunk_ids=None) -> BM25Index:
+    '''dùng file .bm25.npz nếu còn khớp Chunk.json, không thì build lại và ghi đè'''
+    path = bm25_index_file(chunk_file)
+    if chunk_ids is None:
+        chunk_ids = [chunk_id(chunk) for chunk in chunks]
+    index = BM25Index.load(path)
+    if index is not None and index.matches(chunk_ids):
+        return index
+    index = BM25Index.build(chunks)
+    index.save(path)
+    return index
+
+def rrf_fuse(rankings, k=60, top_k=None, with_scores=False):
+    '''reciprocal rank fusion: score(d) = sum 1 / (k + rank), rank bắt đầu từ 1; with_scores -> (order, scores)'''
+    fused = {}
+    for ranking in rankings:
+        for rank, pos in enumerate(ranking, 1):
+            fused[pos] = fused.get(pos, 0.0) + 1.0 / (k + rank)
+    order = sorted(fused, key=fused.get, reverse=True)
+    order = order[:top_k] if top_k else order
+    return (order, [fused[pos] for pos in order]) if with_scores else order
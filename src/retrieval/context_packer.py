@@ -0,0 +1,118 @@
+import os
+import sys
+import logging
+from collections import namedtuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.utils.config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, CONTEXT_MIN_TRIM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+'''
+1 chunk sau retrieval + rerank:
+position: vị trí trong Chunk.json (chunk liền nhau của cùng Điều có position liên tiếp)
+tokens: số token đếm sẵn lúc build index (.tokens.npz)
+'''
+Passage = namedtuple('Passage', ['answer', 'score', 'position', 'chuong', 'muc', 'dieu', 'noidung', 'tokens'])
+
+SHINGLE_SIZE = 5
+MAX_OVERLAP_WORDS = 80      # split_text overlap 50 từ, để dư
+
+def _shingles(words, n=SHINGLE_SIZE):
+    if len(words) < n:
+        return {tuple(words)}
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def _containment(a, b):
+    '''tỉ lệ shingle của đoạn ngắn hơn nằm trong đoạn dài hơn'''
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+def _overlap(prev_words, words, max_words=MAX_OVERLAP_WORDS):
+    '''số từ đầu của words trùng với đuôi prev_words (phần overlap giữa 2 split liên tiếp)'''
+    for size in range(min(len(prev_words), len(words), max_words), 0, -1):
+        if prev_words[-size:] == words[:size]:
+            return size
+    return 0
+
+def _trim(text, max_words):
+    '''cắt còn max_words từ, ưu tiên dừng ở cuối câu'''
+    words = text.split()
+    if len(words) <= max_words:
+        return text
+    cut = ' '.join(words[:max_words])
+    end = max(cut.rfind('. '), cut.rfind('; '))
+    if end > len(cut) // 2:
+        cut = cut[:end + 1]
+    return cut + ' ...'
+
+class _Block:
+    '''các chunk cùng 1 Điều gộp lại thành 1 đoạn trong prompt'''
+    def __init__(self, passage):
+        self.header = ' '.join(f"Theo {passage.chuong} {passage.muc} {passage.dieu}".split())
+        self.score = passage.score
+        self.members = [passage]
+
+    def add(self, passage):
+        self.members.append(passage)
+
+    def render(self):
+        '''-> (text, tokens); chunk liền nhau bỏ phần overlap, chunk cách xa nối bằng "..."'''
+        parts, tokens, prev = [], 0, None
+        for p in sorted(self.members, key=lambda p: p.position):
+            words = p.noidung.split()
+            kept = words
+            if prev is not None and p.position == prev.position + 1:
+                kept = words[_overlap(prev.noidung.split(), words):]
+            elif prev is not None:
+                parts.append('...')
+            if kept:
+                parts.append(' '.join(kept))
+                tokens += p.tokens * len(kept) / max(len(words), 1)
+            prev = p
+        return f"{self.header}, {' '.join(parts)}", int(round(tokens))
+
+def pack_context(passages, token_budget=CONTEXT_TOKEN_BUDGET, max_chunks=10,
+                 dedup_threshold=CONTEXT_DEDUP_THRESHOLD, min_trim_tokens=CONTEXT_MIN_TRIM_TOKENS):
+    '''
+    passages đã sắp xếp theo điểm rerank giảm dần -> list đoạn văn bản cho prompt, tổng token <= token_budget
+    1. bỏ chunk gần trùng với chunk điểm cao hơn (overlap giữa các split)
+    2. gộp chunk cùng Điều thành 1 đoạn, thứ tự theo điểm cao nhất của Điều
+    3. thêm lần lượt tới khi hết ngân sách, đoạn cuối bị cắt bớt nếu còn >= min_trim_tokens
+    '''
+    kept, seen, duplicates = [], [], 0
+    for p in passages[:max_chunks]:
+        shingles = _shingles(p.noidung.split())
+        if any(_containment(shingles, other) >= dedup_threshold for other in seen):
+            duplicates += 1
+            continue
+        seen.append(shingles)
+        kept.append(p)
+
+    blocks, by_dieu = [], {}
+    for p in kept:
+        key = (p.chuong, p.muc, p.dieu) if p.dieu else ('position', p.position)
+        if key in by_dieu:
+            by_dieu[key].add(p)
+        else:
+            by_dieu[key] = _Block(p)
+            blocks.append(by_dieu[key])
+
+    texts, used = [], 0
+    for block in blocks:
+        text, tokens = block.render()
+        if used + tokens > token_budget:
+            remaining = token_budget - used
+            if remaining >= min_trim_tokens:
+                words = len(text.split())
+                texts.append(_trim(text, int(words * remaining / max(tokens, 1))))
+                used = token_budget
+            break
+        texts.append(text)
+        used += tokens
+
+    logger.info(f"Context: {len(texts)} đoạn từ {len(passages[:max_chunks])} chunk, ~{used}/{token_budget} token "
+                f"(bỏ {duplicates} chunk trùng, gộp còn {len(blocks)} Điều)")
+    return texts
@@ -5,73 +5,401 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
 # Internal imports
-from src.utils.chat_history import query_cache, get_cache
+from src.utils.chat_history import query_cache, get_cache, acquire_lock, release_lock, is_locked, r as redis_client
+from src.utils.cache import EmbeddingCache, TTLCache, SingleFlight, query_key
+from src.data_processors.doc_chunking import (
+    chunk_answer, count_chunk_tokens, token_counts_file, load_token_counts
+)
+from src.database.index_factory import set_search_params, vectors_file, load_vectors, rescore
+from src.database.chunk_store import load_chunks, chunk_source, iter_labels
+from src.retrieval.reranker import BatchingReranker
+from src.models.registry import get_model
+from src.embeddings.backends import embedding_namespace
+from src.retrieval.context_packer import Passage
+from src.retrieval.bm25 import load_or_build_bm25, rrf_fuse
+from src.retrieval.structure_index import StructureIndex, detect_reference
+from src.retrieval.adaptive_rerank import AdaptiveReranker
+from src.utils.config import (
+    INDEX_FILE, CHUNK_FILE, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_REDIS,
+    RERANKER_BACKEND,
+    RESULT_CACHE_ENABLED, RESULT_CACHE_TTL, RESULT_CACHE_LOCK_WAIT, RERANK_MAX_BATCH_SIZE, RERANK_MAX_WAIT_MS,
+    PAIR_SCORE_CACHE_SIZE, PAIR_SCORE_CACHE_TTL, HYBRID_ENABLED, BM25_TOP_K, RRF_K,
+    STRUCTURE_LOOKUP_ENABLED, ADAPTIVE_RERANK_ENABLED, RERANK_SKIP_MARGIN, RERANK_TOP_N,
+    RERANK_CASCADE_ENABLED, RERANK_CASCADE_MARGIN, RERANK_AUDIT_RATE, RESCORE_ENABLED, RESCORE_FACTOR
+)
 
 import numpy as np
-from transformers import AutoTokenizer, AutoModel
-import torch
 import faiss
 import json
 import time
-from sentence_transformers import CrossEncoder
+import struct
+import hashlib
+import threading
+import logging
+from collections import namedtuple
 
-tokenizer = AutoTokenizer.from_pretrained("truro7/vn-law-embedding")
-model = AutoModel.from_pretrained("truro7/vn-law-embedding")
+logger = logging.getLogger(__name__)
+
+# model load lần đầu khi cần qua src.models.registry, import module này không load model
 rerank_model = [ 
-    (CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2'), 0.4),
-    # (CrossEncoder('BAAI/bge-reranker-v2-m3'), 0.35),
+    ('reranker', 0.4),
+]
+if RERANK_CASCADE_ENABLED:
+    rerank_model.append(('reranker-heavy', 0.35))     # bge-reranker-v2-m3, chỉ chạy khi reranker nhẹ phân vân
+# mỗi cross-encoder 1 batcher dùng chung cho mọi request trong process
+rerankers = [
+    (BatchingReranker(lambda name=name: get_model(name), RERANK_MAX_BATCH_SIZE, RERANK_MAX_WAIT_MS / 1000), weight)
+    for name, weight in rerank_model
 ]
+# điểm rerank theo (model, hash câu hỏi, id chunk)
+pair_score_cache = TTLCache(PAIR_SCORE_CACHE_SIZE, PAIR_SCORE_CACHE_TTL)
+adaptive_reranker = AdaptiveReranker(
+    rerankers[0], rerankers[1] if len(rerankers) > 1 else None, pair_score_cache,
+    skip_margin=RERANK_SKIP_MARGIN, top_n=RERANK_TOP_N, cascade_margin=RERANK_CASCADE_MARGIN,
+    audit_rate=RERANK_AUDIT_RATE, enabled=ADAPTIVE_RERANK_ENABLED,
+)
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL,
+    redis_client=redis_client if EMBEDDING_CACHE_REDIS else None,
+    namespace=embedding_namespace(),     # model / torch / onnx int8 / fp32 cho vector khác nhau -> không dùng lẫn
+)
+
 '''embedding query'''
+def _embed_query(query):
+    # backend torch hoặc onnx tuỳ EMBEDDING_BACKEND, vector đã L2 normalize
+    return get_model('embedding').encode([query], batch_size=1, max_length=512)[0]
+
 def get_vietnamese_embedding(query):
-    inputs = tokenizer(query, return_tensors="pt", truncation=True, max_length=512, padding=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        embedding = outputs.last_hidden_state[:, 0, :].numpy().flatten()
-        norm = np.linalg.norm(embedding)
-        return embedding / norm if norm > 0 else embedding
+    # câu hỏi lặp lại (sau chuẩn hoá) không phải chạy lại model
+    return embedding_cache.get_or_compute(query, _embed_query)
+
+'''result cache: lưu kết quả retrieve() trong Redis'''
+RESULT_CACHE_VERSION = 3
+
+# [version u8][n u16][total_tokens u32][positions int32 * n][scores float32 * n]
+# chỉ lưu vị trí chunk, nội dung lấy lại từ metadata (cùng fingerprint) -> nhỏ hơn nhiều so với json
+def pack_result(result):
+    positions, scores, total_tokens = result
+    return (struct.pack('<BHI', RESULT_CACHE_VERSION, len(positions), total_tokens)
+            + np.asarray(positions, dtype='<i4').tobytes() + np.asarray(scores, dtype='<f4').tobytes())
+
+def unpack_result(raw):
+    version, n, total_tokens = struct.unpack_from('<BHI', raw)
+    if version != RESULT_CACHE_VERSION:
+        return None
+    offset = struct.calcsize('<BHI')
+    positions = np.frombuffer(raw, dtype='<i4', count=n, offset=offset).tolist()
+    scores = np.frombuffer(raw, dtype='<f4', count=n, offset=offset + 4 * n).tolist()
+    return positions, scores, total_tokens
+
+class ResultCache:
+    def __init__(self, ttl=3600, lock_timeout=30, lock_wait=2.0, poll_interval=0.02, max_poll_interval=0.2):
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait                  # chờ ngắn: thread chờ là thread của model_executor
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.single_flight = SingleFlight()     # trong process: các miss giống nhau chỉ tính 1 lần
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        try:
+            raw = get_cache(key, raw=True)
+        except Exception as e:
+            logger.warning(f"Redis result cache lỗi: {str(e)}")
+            return None
+        return unpack_result(raw) if raw else None
+
+    def _set(self, key, result):
+        try:
+            query_cache(key, pack_result(result), seconds=self.ttl)
+        except Exception as e:
+            logger.warning(f"Redis result cache lỗi: {str(e)}")
+
+    def _compute_locked(self, key, compute):
+        # giữa các process: ai lấy được lock thì tính, các process khác chờ kết quả trong Redis
+        try:
+            token = acquire_lock(key, self.lock_timeout)
+        except Exception:
+            return compute()
+        if token is None:
+            deadline = time.monotonic() + self.lock_wait
+            interval = self.poll_interval
+            while time.monotonic() < deadline:
+                time.sleep(interval)
+                interval = min(interval * 2, self.max_poll_interval)
+                result = self._get(key)
+                if result is not None:
+                    return result
+                if not is_locked(key):  # process giữ lock bị lỗi -> tự tính
+                    break
+        try:
+            result = compute()
+            self._set(key, result)
+            return result
+        finally:
+            if token is not None:
+                try:
+                    release_lock(key, token)
+                except Exception as e:
+                    logger.warning(f"Redis result cache lỗi: {str(e)}")
+
+    def get_or_compute(self, key, compute):
+        result = self._get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        return self.single_flight.do(key, lambda: self._compute_locked(key, compute))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+result_cache = ResultCache(RESULT_CACHE_TTL, lock_wait=RESULT_CACHE_LOCK_WAIT)
+
+class RetrievalCancelled(Exception):
+    pass
+
+class IndexMismatch(Exception):
+    pass
+
+'''retriever: load faiss index + Chunk.json 1 lần, giữ trong bộ nhớ'''
+# chunk_ids: id (hash nội dung) của từng chunk, theo vị trí trong Chunk.json
+# id_to_pos: faiss id -> vị trí trong Chunk.json (None nếu index dùng vị trí làm id)
+# token_counts: số token của chunk_answer theo vị trí, đếm sẵn lúc build index
+# fingerprint: hash nội dung file index + Chunk.json, dùng làm version cho result cache
+# vectors: vector float32 gốc (mmap) khi index lưu vector nén, None nếu index đã chính xác
+RetrieverState = namedtuple('RetrieverState', [
+    'index', 'metadata', 'chunk_ids', 'id_to_pos', 'token_counts', 'bm25', 'structure', 'signature', 'fingerprint',
+    'vectors'
+])
+
+def file_fingerprint(*paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+class Retriever:
+    def __init__(self, index_file=INDEX_FILE, metadata_file=CHUNK_FILE, check_interval=2.0):
+        self.index_file = index_file
+        self.metadata_file = metadata_file
+        self.check_interval = check_interval    # giây giữa 2 lần stat() file index
+        self._lock = threading.Lock()
+        self._state = None                      # RetrieverState
+        self._last_check = 0.0
+        self._rejected = None                   # signature của cặp file lệch nhau, không load lại cho tới khi file đổi
+
+    def _signature(self):
+        index_stat = os.stat(self.index_file)
+        metadata_stat = os.stat(chunk_source(self.metadata_file))
+        return (index_stat.st_mtime_ns, index_stat.st_size,
+                metadata_stat.st_mtime_ns, metadata_stat.st_size)
+
+    def _load(self, signature):
+        index = set_search_params(faiss.read_index(self.index_file))
+        # metadata: ChunkStore (mmap, đọc từng chunk khi cần) hoặc list dict nếu chưa có chunk store
+        source = chunk_source(self.metadata_file)
+        metadata, chunk_ids = load_chunks(self.metadata_file)
+        id_to_pos = None
+        if hasattr(index, 'id_map'):
+            # index build bằng incremental_index: id = hash nội dung chunk
+            id_to_pos = {}
+            for pos, cid in enumerate(chunk_ids):
+                id_to_pos.setdefault(cid, pos)
+        mismatch = self._check_consistency(index, metadata, id_to_pos)
+        if mismatch:
+            if self._state is not None:
+                # vd. chạy doc_chunking ghi Chunk.json mới nhưng chưa build lại index -> giữ bản cũ
+                raise IndexMismatch(f"{self.index_file} không khớp {source}: {mismatch}")
+            logger.warning(f"{self.index_file} không khớp {source}: {mismatch}, cần build lại index")
+
+        known = load_token_counts(token_counts_file(self.metadata_file))
+        missing = [pos for pos, cid in enumerate(chunk_ids) if cid not in known]
+        if missing:
+            # index cũ chưa có file token -> đếm 1 lần lúc load
+            logger.info(f"Đếm token cho {len(missing)} chunk chưa có trong {token_counts_file(self.metadata_file)}")
+            counts = count_chunk_tokens([metadata[pos] for pos in missing], get_model('embedding').tokenizer)
+            known.update((chunk_ids[pos], count) for pos, count in zip(missing, counts))
+        token_counts = np.array([known[cid] for cid in chunk_ids], dtype=np.int32)
+        bm25 = load_or_build_bm25(metadata, self.metadata_file, chunk_ids) if HYBRID_ENABLED else None
+        structure = StructureIndex(iter_labels(metadata))
+        vectors = None
+        if RESCORE_ENABLED and id_to_pos is None and not isinstance(index, faiss.IndexFlat):
+            vectors = load_vectors(vectors_file(self.index_file), index.ntotal)
+            if vectors is not None:
+                logger.info(f"Chấm lại ứng viên bằng vector gốc {vectors_file(self.index_file)} (mmap)")
+        fingerprint = file_fingerprint(self.index_file, source)
+        logger.info(f"Loaded {index.ntotal} vectors from {self.index_file}, {len(metadata)} chunks from {source} ({fingerprint})")
+        return RetrieverState(index, metadata, chunk_ids, id_to_pos, token_counts, bm25, structure, signature, fingerprint,
+                              vectors)
+
+    @staticmethod
+    def _check_consistency(index, metadata, id_to_pos):
+        '''-> mô tả chỗ lệch giữa index và chunk, None nếu khớp'''
+        if id_to_pos is None:
+            # index theo vị trí: vector thứ i là chunk thứ i
+            if index.ntotal != len(metadata):
+                return f"{index.ntotal} vectors, {len(metadata)} chunks"
+            return None
+        ids = faiss.vector_to_array(index.id_map)
+        unknown = sum(1 for cid in ids.tolist() if cid not in id_to_pos)
+        if unknown:
+            return f"{unknown}/{len(ids)} vector không còn chunk tương ứng"
+        return None
+
+    def state(self):
+        """
+        Trả về snapshot RetrieverState hiện tại.
+        Reload khi file trên đĩa thay đổi; snapshot mới được dựng xong rồi mới thay thế,
+        nên request đang chạy luôn dùng index và metadata cùng một phiên bản.
+        """
+        state = self._state
+        if state is not None and time.monotonic() - self._last_check < self.check_interval:
+            return state
+        with self._lock:
+            state = self._state
+            if state is not None and time.monotonic() - self._last_check < self.check_interval:
+                return state
+            self._last_check = time.monotonic()
+            try:
+                signature = self._signature()
+                if state is None or (signature != state.signature and signature != self._rejected):
+                    self._state = state = self._load(signature)
+            except IndexMismatch as e:
+                # index và chunk lệch nhau -> chờ build lại index (signature đổi) rồi mới thử lại
+                self._rejected = signature
+                logger.error(f"Không reload, dùng bản cũ: {str(e)}")
+            except Exception as e:
+                if state is None:
+                    raise
+                # file đang được ghi dở -> giữ bản cũ, thử lại lần sau
+                logger.error(f"Reload index thất bại, dùng bản cũ: {str(e)}")
+            return state
+
+    def reload(self):
+        with self._lock:
+            self._last_check = time.monotonic()
+            self._state = self._load(self._signature())
+            return self._state
+
+    def search(self, query, top_k=10, state=None):
+        '''faiss search -> (vị trí trong Chunk.json, similarity)'''
+        state = state or self.state()
+        query_embedding = get_vietnamese_embedding(query).reshape(1, -1)
+        if state.vectors is not None:
+            # index nén: lấy rộng hơn rồi chấm lại bằng vector float32 -> điểm và thứ tự như index Flat
+            _, candidates = state.index.search(query_embedding, top_k * RESCORE_FACTOR)
+            similarities, indices = rescore(state.vectors, query_embedding, candidates[0], top_k)
+        else:
+            similarities, indices = state.index.search(query_embedding, top_k)        ### lay top k 
+            similarities, indices = similarities[0], indices[0]
+        positions, scores = [], []
+        for idx, similarity in zip(indices, similarities):
+            if idx < 0:
+                continue
+            pos = idx if state.id_to_pos is None else state.id_to_pos.get(int(idx))
+            if pos is None:     # vector của chunk đã bị xoá khỏi Chunk.json
+                continue
+            positions.append(int(pos))
+            scores.append(float(similarity))
+        return positions, scores
+
+    def _rank(self, state, query, top_k, cancel_event=None):
+        '''search (faiss + BM25) + rerank -> (positions đã sắp xếp, điểm fuse của từng position, total_tokens)'''
+        positions, dense_scores = self.search(query, top_k, state)
+        fused_scores = dense_scores
+        dense_first = positions[0] if positions else None
+        if state.bm25 is not None:
+            # câu hỏi có từ khoá chính xác ("Điều 35", số tiền) -> BM25 bắt được dù dense bỏ sót
+            keyword_positions, _ = state.bm25.search(query, BM25_TOP_K)
+            positions, fused_scores = rrf_fuse([positions, keyword_positions], RRF_K, top_k, with_scores=True)
+        if cancel_event is not None and cancel_event.is_set():
+            raise RetrievalCancelled()      # không cần kết quả nữa -> bỏ qua bước rerank
+        retrieved_chunks = [state.metadata[pos] for pos in positions]
+
+        # [query, chunk]
+        query_chunk = [[query, f"{chunk.get('muc', '')} {chunk.get('dieu', '')} {chunk['noidung']}"] for chunk in retrieved_chunks]    # muc + dieu + muc + noi dung + querr -> re-rerank 
+        if not query_chunk:
+            return [], [], 0
+
+        # score: bỏ qua / chỉ top-N bằng reranker nhẹ / cascade sang reranker nặng tuỳ độ chắc của điểm
+        # cặp (câu hỏi, chunk) đã chấm điểm thì lấy từ cache, chỉ predict cặp mới
+        order, sorted_scores, _ = adaptive_reranker.rerank(
+            query_key(query), [state.chunk_ids[pos] for pos in positions], query_chunk,
+            dense_scores, fused_scores, positions[0] == dense_first)
+        sorted_positions = [positions[i] for i in order]
+        total_tokens = int(state.token_counts[sorted_positions].sum())
+        return sorted_positions, sorted_scores, total_tokens
+
+    def retrieve_passages(self, query, top_k=10, output_file='data/retrieval.json', cancel_event=None):
+        '''-> (list Passage theo thứ tự rerank, retrieval_time, total_tokens); score: điểm retrieval (fuse) của chunk'''
+        start_time = time.time()
+        if cancel_event is not None and cancel_event.is_set():
+            raise RetrievalCancelled()
+
+        state = self.state()
+        positions = state.structure.lookup(detect_reference(query), top_k) if STRUCTURE_LOOKUP_ENABLED else []
+        if positions:
+            # câu hỏi nhắc thẳng Điều / Chương / Mục -> lấy chunk theo thứ tự văn bản, không embedding, không rerank
+            logger.info(f"Tra cứu trực tiếp {len(positions)} chunk theo tham chiếu trong câu hỏi")
+            scores = [1.0] * len(positions)
+            total_tokens = int(state.token_counts[positions].sum())
+        elif RESULT_CACHE_ENABLED:
+            # key gắn với fingerprint của index + Chunk.json -> build lại index là cache cũ tự hết hiệu lực
+            mode = f"{'hybrid' if state.bm25 is not None else 'dense'}-{embedding_namespace()}-{RERANKER_BACKEND}" \
+                   f"{'-adaptive' if ADAPTIVE_RERANK_ENABLED else ''}"
+            key = f"retrieval:v{RESULT_CACHE_VERSION}:{state.fingerprint}:{mode}:{top_k}:{query_key(query)}"
+            try:
+                positions, scores, total_tokens = result_cache.get_or_compute(
+                    key, lambda: self._rank(state, query, top_k, cancel_event))
+            except RetrievalCancelled:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise
+                # request khác cùng key bị huỷ giữa chừng -> tự tính
+                positions, scores, total_tokens = self._rank(state, query, top_k)
+        else:
+            positions, scores, total_tokens = self._rank(state, query, top_k, cancel_event)
+
+        passages = []
+        for pos, score in zip(positions, scores):
+            chunk = state.metadata[pos]
+            passages.append(Passage(chunk_answer(chunk), score, int(pos), chunk.get('chuong') or '', chunk.get('muc') or '',
+                                    chunk.get('dieu') or '', chunk.get('noidung') or '', int(state.token_counts[pos])))
+
+        if output_file:
+            results = [{"answer": p.answer, "score": p.score} for p in passages]
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+
+        retrieval_time = time.time() - start_time
+        return passages, retrieval_time, total_tokens
+
+    def retrieve(self, query, top_k=10, output_file='data/retrieval.json', cancel_event=None):
+        passages, retrieval_time, total_tokens = self.retrieve_passages(query, top_k, output_file, cancel_event)
+        return [p.answer for p in passages], [p.score for p in passages], retrieval_time, total_tokens
+
+_retrievers = {}
+_retrievers_lock = threading.Lock()
+
+def get_retriever(index_file=INDEX_FILE, metadata_file=CHUNK_FILE):
+    '''1 Retriever dùng chung cho cả process (api, gradio, cli)'''
+    key = (os.path.abspath(index_file), os.path.abspath(metadata_file))
+    with _retrievers_lock:
+        if key not in _retrievers:
+            _retrievers[key] = Retriever(index_file, metadata_file)
+        return _retrievers[key]
+
 '''retrieval'''
-def retrieve(query, top_k=10, index_file='src/database/faiss.index', output_file='data/retrieval.json'):
-    start_time = time.time()
-    
-    index = faiss.read_index(index_file)
-    with open("data/Chunk.json", "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    query_embedding = get_vietnamese_embedding(query).reshape(1, -1)
-    similarities, indices = index.search(query_embedding, top_k)        ### lay top k 
-    
-    retrieved_chunks = [metadata[idx] for idx in indices[0]]
-    
-    # [query, chunk]
-    query_chunk = [[query, f"{chunk.get('muc', '')} {chunk.get('dieu', '')} {chunk['noidung']}"] for chunk in retrieved_chunks]    # muc + dieu + muc + noi dung + querr -> re-rerank 
-    
-    # score  --------------------------------------- sum = weight * score 
-    all_scores = []
-    for model, weight in rerank_model:
-        scores = model.predict(query_chunk)
-        # weighted_scores = scores * weight
-        all_scores.append(scores)
-    
-    all_scores = np.stack(all_scores, axis=1)
-    avg_scores = np.sum(all_scores, axis=1)
+def retrieve(query, top_k=10, index_file=INDEX_FILE, output_file='data/retrieval.json', cancel_event=None):
+    return get_retriever(index_file).retrieve(query, top_k, output_file, cancel_event)
 
-    # sort
-    sorted_indices = np.argsort(avg_scores)[::-1]  # Giảm dần
-    sorted_chunks = [retrieved_chunks[i] for i in sorted_indices]
-    sorted_scores = [avg_scores[i] for i in sorted_indices]
-    
-    results = []
-    total_tokens = 0
-    
-    for chunk, score in zip(sorted_chunks, sorted_scores):
-        answer = f"Theo {chunk.get('chuong', '')} {chunk.get('muc', '')} {chunk.get('dieu', '')}, {chunk.get('noidung', '')}"
-        results.append({"answer": answer, "score": float(score)})
-        total_tokens += len(tokenizer.encode(answer))
-    
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    
-    retrieval_time = time.time() - start_time
-    return [result["answer"] for result in results], [result["score"] for result in results], retrieval_time, total_tokens
+def retrieve_passages(query, top_k=10, index_file=INDEX_FILE, output_file='data/retrieval.json', cancel_event=None):
+    return get_retriever(index_file).retrieve_passages(query, top_k, output_file, cancel_event)
 
 # if __name__ == "__main__":
 #     query = input('query: ')
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import logging
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.embeddings.backends import onnx_model_dir, onnx_model_path, create_session
+from src.utils.config import ONNX_QUANTIZE, RERANKER_ONNX_BATCH, RERANKER_SEQ_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+'''
+Backend onnx cho cross-encoder: cùng interface predict(pairs) như sentence_transformers.CrossEncoder.
+Input luôn có shape cố định: batch pad lên RERANKER_ONNX_BATCH, độ dài pad lên bucket gần nhất
+trong RERANKER_SEQ_BUCKETS -> ONNX Runtime chỉ gặp vài shape, dùng lại được memory plan giữa các request.
+'''
+def export_reranker_onnx(model_name, quantize=True, opset=17):
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    out_dir = onnx_model_dir(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+    cross_encoder = CrossEncoder(model_name, device='cpu')
+    model = cross_encoder.model.eval()
+    tokenizer = cross_encoder.tokenizer
+
+    start = time.time()
+    sample = tokenizer([['câu hỏi', 'đoạn văn']] * 2, padding=True, return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class LogitsWrapper(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).logits
+
+    fp32_path = onnx_model_path(model_name, quantize=False)
+    torch.onnx.export(
+        LogitsWrapper(model), tuple(sample[name] for name in input_names), fp32_path,
+        input_names=input_names, output_names=['logits'],
+        dynamic_axes={**{name: {0: 'batch', 1: 'seq'} for name in input_names}, 'logits': {0: 'batch'}},
+        opset_version=opset,
+    )
+    tokenizer.save_pretrained(out_dir)
+    # CrossEncoder 1 nhãn thường qua sigmoid -> lưu lại để điểm onnx cùng thang với bản torch
+    activation = getattr(cross_encoder, 'activation_fct', None) or getattr(cross_encoder, 'default_activation_function', None)
+    with open(os.path.join(out_dir, 'activation.json'), 'w') as f:
+        json.dump({'sigmoid': isinstance(activation, torch.nn.Sigmoid)}, f)
+    logger.info(f"Export {model_name} -> {fp32_path} ({time.time() - start:.1f}s)")
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, onnx_model_path(model_name, quantize=True), weight_type=QuantType.QInt8, per_channel=True)
+    return onnx_model_path(model_name, quantize)
+
+class OnnxCrossEncoder:
+    backend = 'onnx'
+
+    def __init__(self, model_name, quantize=ONNX_QUANTIZE, batch_size=RERANKER_ONNX_BATCH, seq_buckets=RERANKER_SEQ_BUCKETS):
+        from transformers import AutoTokenizer
+        path = onnx_model_path(model_name, quantize)
+        if not os.path.exists(path):
+            logger.info(f"Chưa có {path}, export {model_name} sang ONNX")
+            export_reranker_onnx(model_name, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_model_dir(model_name))
+        self.session = create_session(path)
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        with open(os.path.join(onnx_model_dir(model_name), 'activation.json')) as f:
+            self.sigmoid = json.load(f)['sigmoid']
+        self.batch_size = batch_size
+        self.seq_buckets = sorted(seq_buckets)
+
+    def _bucket(self, length):
+        for bucket in self.seq_buckets:
+            if length <= bucket:
+                return bucket
+        return self.seq_buckets[-1]
+
+    def predict(self, pairs, batch_size=None, show_progress_bar=False):
+        '''batch_size / show_progress_bar giữ cho giống CrossEncoder.predict, batch thực tế luôn là self.batch_size'''
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        max_length = self.seq_buckets[-1]
+        encoded = self.tokenizer([p[0] for p in pairs], [p[1] for p in pairs], truncation=True, max_length=max_length)
+        lengths = np.array([len(ids) for ids in encoded['input_ids']])
+        order = np.argsort(lengths, kind='stable')
+        scores = np.zeros(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), self.batch_size):
+            batch_idx = order[start:start + self.batch_size]
+            seq = self._bucket(int(lengths[batch_idx].max()))
+            feeds = {}
+            for name in self.input_names:
+                # pad cả 2 chiều về shape cố định (batch_size, seq); hàng thừa toàn 0, bỏ kết quả
+                array = np.zeros((self.batch_size, seq), dtype=np.int64)
+                if name == 'input_ids' and self.tokenizer.pad_token_id:
+                    array.fill(self.tokenizer.pad_token_id)
+                for row, i in enumerate(batch_idx):
+                    values = encoded[name][i] if name in encoded else [0] * len(encoded['input_ids'][i])
+                    array[row, :len(values)] = values
+                feeds[name] = array
+            logits = self.session.run(None, feeds)[0][:len(batch_idx), 0]
+            scores[batch_idx] = logits
+        if self.sigmoid:
+            scores = 1.0 / (1.0 + np.exp(-scores))
+        return scores
+
+def load_reranker(model_name, backend='torch'):
+    if backend == 'torch':
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+    if backend == 'onnx':
+        return OnnxCrossEncoder(model_name)
+    raise ValueError(f"RERANKER_BACKEND '{backend}' không hợp lệ, chọn: torch, onnx")
+
+if __name__ == '__main__':
+    # export trước khi deploy: python src/retrieval/rerank_backends.py
+    from src.utils.config import RERANKER_MODEL_NAME
+    logging.basicConfig(level=logging.INFO)
+    print(export_reranker_onnx(RERANKER_MODEL_NAME, quantize=ONNX_QUANTIZE))
@@ -0,0 +1,85 @@
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+Micro-batching cho cross-encoder: gom các cặp [query, chunk] của nhiều request đang chạy
+trong khoảng max_wait giây (hoặc tới max_batch_size cặp), predict 1 lần rồi trả điểm về từng request.
+model_fn: hàm trả về cross-encoder, chỉ gọi khi có batch đầu tiên (model load lazy qua registry).
+'''
+class BatchingReranker:
+    def __init__(self, model_fn, max_batch_size=64, max_wait=0.005):
+        self.model_fn = model_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.batches = 0
+        self.pairs = 0
+        self.requests = 0
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name='reranker-batcher', daemon=True)
+                    self._worker.start()
+
+    def predict(self, pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((pairs, future))
+        return future.result()
+
+    def _collect(self):
+        # chờ request đầu tiên, sau đó gom thêm tới khi đủ batch hoặc hết max_wait
+        batch = [self._queue.get()]
+        n_pairs = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while n_pairs < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_pairs += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            try:
+                model = self.model_fn()
+                scores = np.asarray(model.predict(all_pairs, batch_size=len(all_pairs), show_progress_bar=False))
+            except Exception as e:
+                logger.error(f"Rerank batch lỗi: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.pairs += len(all_pairs)
+            self.requests += len(batch)
+            offset = 0
+            for pairs, future in batch:
+                future.set_result(scores[offset:offset + len(pairs)])
+                offset += len(pairs)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'pairs': self.pairs,
+            'avg_batch_pairs': self.pairs / self.batches if self.batches else 0.0,
+            'queue_depth': self._queue.qsize(),
+        }
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from src.retrieval.query import get_vietnamese_embedding, get_retriever
+from src.retrieval.structure_index import detect_reference
+from src.utils.config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL
+
+'''
+Cache câu trả lời theo ngữ nghĩa: câu hỏi mới giống câu hỏi đã trả lời (cosine >= threshold)
+thì trả lại answer + context cũ, không gọi LLM.
+Cache bị xoá khi index pháp luật thay đổi (fingerprint của Retriever đổi).
+Câu hỏi nhắc thẳng Điều / Chương / Mục không lookup cũng không store: tra trực tiếp đã nhanh,
+và câu trả lời cho "Điều 98" không được trả lại cho câu hỏi na ná về điều khác.
+'''
+def cacheable(query):
+    return detect_reference(query) is None
+
+class SemanticCache:
+    def __init__(self, threshold=0.95, maxsize=1000, ttl=86400, version_fn=None):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_fn = version_fn or (lambda: get_retriever().state().fingerprint)
+        self._lock = threading.Lock()
+        self._index = None                  # IndexIDMap2(IndexFlatIP), tạo khi có entry đầu tiên
+        self._entries = OrderedDict()       # id -> (expire_at, query, answer, context), thứ tự LRU
+        self._next_id = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_version(self, version):
+        if version != self._version:
+            self._index = None
+            self._entries.clear()
+            self._version = version
+
+    def _remove(self, entry_id):
+        del self._entries[entry_id]
+        self._index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def lookup(self, query):
+        if not cacheable(query):
+            return None     # không cần embed câu hỏi
+        version = self.version_fn()
+        embedding = get_vietnamese_embedding(query).reshape(1, -1)
+        with self._lock:
+            self._sync_version(version)
+            if self._entries:
+                similarities, ids = self._index.search(embedding, 1)
+                entry_id = int(ids[0][0])
+                if entry_id >= 0 and similarities[0][0] >= self.threshold:
+                    expire_at, _, answer, context = self._entries[entry_id]
+                    if expire_at > time.monotonic():
+                        self._entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return answer, context
+                    self._remove(entry_id)
+            self.misses += 1
+            return None
+
+    def store(self, query, answer, context, grounded=True):
+        '''grounded=False: câu trả lời không dựa trên context pháp luật (prompt fallback) -> không cache'''
+        if not grounded or not cacheable(query):
+            return
+        version = self.version_fn()
+        embedding = get_vietnamese_embedding(query).reshape(1, -1)
+        with self._lock:
+            self._sync_version(version)
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(embedding.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(embedding, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (time.monotonic() + self.ttl, query, answer, context)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'threshold': self.threshold,
+        }
+
+answer_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_TTL)
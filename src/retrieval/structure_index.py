@@ -0,0 +1,131 @@
+import re
+import logging
+import unicodedata
+from collections import namedtuple
+from unidecode import unidecode
+
+logger = logging.getLogger(__name__)
+
+'''
+Tra cứu trực tiếp theo cấu trúc văn bản luật:
+chunking_text đã gán chuong / muc / dieu cho từng chunk -> map số Điều / Mục / Chương -> vị trí chunk.
+Câu hỏi nhắc rõ "Điều 98", "Chương III", "Mục 2 Chương IV" -> lấy chunk trực tiếp, không cần embedding + rerank.
+'''
+# dieu: list số Điều; chuong: số Chương (int) hoặc None; muc: số Mục hoặc None
+Reference = namedtuple('Reference', ['dieu', 'chuong', 'muc'])
+
+ROMAN = {'i': 1, 'v': 5, 'x': 10, 'l': 50, 'c': 100}
+
+def roman_to_int(text):
+    text = text.lower()
+    if not text or any(ch not in ROMAN for ch in text):
+        return None
+    total = 0
+    for i, ch in enumerate(text):
+        value = ROMAN[ch]
+        total += -value if i + 1 < len(text) and ROMAN[text[i + 1]] > value else value
+    return total
+
+def _number(text):
+    return int(text) if text.isdigit() else roman_to_int(text)
+
+def _fold(text):
+    return unidecode(text or '').lower()
+
+# nhãn trong Chunk.json: "Điều 98. Tiền lương", "Chương VI", "Mục 2. ..."
+LABEL_PATTERNS = {
+    'dieu': re.compile(r'^\s*dieu\s+(\d+)'),
+    'chuong': re.compile(r'^\s*chuong\s+([ivxlc]+|\d+)\b'),
+    'muc': re.compile(r'^\s*muc\s+(\d+)'),
+}
+
+# trong câu hỏi (không dấu): "dieu 98"; "điều kiện" không khớp vì cần số phía sau
+QUERY_PATTERNS = {
+    'dieu': re.compile(r'\bdieu\s+(\d+)\b'),
+    'chuong': re.compile(r'\bchuong\s+([ivxlc]+|\d+)\b'),
+}
+# "mục" và "mức" bỏ dấu đều thành "muc" ("muc 2 trieu") -> Mục chỉ nhận khi gõ có dấu, so khớp trên câu gốc
+QUERY_MUC_PATTERN = re.compile(r'\bmục\s+(\d+)\b')
+# sau số phải là hết câu / dấu câu / từ hay đi sau nhãn ("Điều 98 nói gì", "Điều 35 quy định")
+# -> "Có 3 điều 2 bên cần lưu ý" không bị coi là tham chiếu; câu mơ hồ đi đường retrieval bình thường
+QUERY_FOLLOW = re.compile(
+    r'\s*(?:$|[.,;:?!)\]"\'-]|(?:noi|quy dinh|cua|ve|va|thi|la|trong|the nao|nhu the nao|gi)\b'
+    r'|(?:khoan|chuong|muc|dieu)\s+(?:\d+|[ivxlc]+)\b)'
+)
+# "Điều 35 Luật Bảo hiểm xã hội", "Điều 5, Nghị định 145" -> có thể là văn bản khác, không tra thẳng Điều của corpus
+NAMED_DOCUMENT = re.compile(r'\s*[,(]?\s*(?:cua\s+)?(?:bo luat|luat|blld|nghi dinh|thong tu|nd|tt)\b')
+# "3 điều", "hai chương" kiểu số đếm; "khoản 2 Điều 35", "Mục 2 Chương IV" thì số trước là của nhãn khác
+COUNTED = re.compile(r'\d+\s*$')
+LABEL_BEFORE = re.compile(r'\b(?:diem|khoan|chuong|muc|dieu)\s+(?:\d+|[ivxlc]+)\s*$')
+
+def _find_labels(pattern, text):
+    '''số của các nhãn khớp pattern; bỏ qua khi ngay trước là số đếm ("3 điều") hoặc phía sau không giống nhãn'''
+    numbers = []
+    for match in pattern.finditer(text):
+        before = _fold(text[:match.start()])
+        if COUNTED.search(before) and not LABEL_BEFORE.search(before):
+            continue
+        after = _fold(text[match.end():])
+        if QUERY_FOLLOW.match(after) and not NAMED_DOCUMENT.match(after):
+            numbers.append(match.group(1))
+    return numbers
+
+def parse_label(kind, label):
+    match = LABEL_PATTERNS[kind].match(_fold(label))
+    return _number(match.group(1)) if match else None
+
+def detect_reference(query):
+    '''-> Reference nếu câu hỏi nhắc rõ Điều / Chương / Mục, ngược lại None'''
+    folded = _fold(query)
+    dieu = [int(n) for n in _find_labels(QUERY_PATTERNS['dieu'], folded)]
+    chuong = [_number(n) for n in _find_labels(QUERY_PATTERNS['chuong'], folded)]
+    muc = [int(n) for n in _find_labels(QUERY_MUC_PATTERN, unicodedata.normalize('NFC', query).lower())]
+    chuong = chuong[0] if chuong and chuong[0] else None
+    muc = muc[0] if muc else None
+    if not dieu and chuong is None and muc is None:
+        return None
+    return Reference(dieu, chuong, muc)
+
+class StructureIndex:
+    '''
+    số Điều / (Chương, Mục) / Chương -> list vị trí chunk trong Chunk.json theo thứ tự văn bản
+    labels: (chuong, muc, dieu) của từng chunk theo vị trí, xem chunk_store.iter_labels
+    '''
+    def __init__(self, labels):
+        self.dieu = {}
+        self.muc = {}
+        self.chuong = {}
+        parsed = {}     # nhãn lặp lại rất nhiều -> parse mỗi nhãn 1 lần
+        for pos, (chuong, muc, dieu) in enumerate(labels):
+            for kind, label in (('chuong', chuong), ('muc', muc), ('dieu', dieu)):
+                if (kind, label) not in parsed:
+                    parsed[(kind, label)] = parse_label(kind, label)
+            chuong = parsed[('chuong', chuong)]
+            muc = parsed[('muc', muc)]
+            dieu = parsed[('dieu', dieu)]
+            if dieu is not None:
+                self.dieu.setdefault(dieu, []).append(pos)
+            if chuong is not None:
+                self.chuong.setdefault(chuong, []).append(pos)
+                if muc is not None:
+                    self.muc.setdefault((chuong, muc), []).append(pos)
+        logger.info(f"Structure index: {len(self.dieu)} Điều, {len(self.muc)} Mục, {len(self.chuong)} Chương")
+
+    def lookup(self, reference, limit=10):
+        '''-> list vị trí chunk (tối đa limit), rỗng nếu không tìm thấy hoặc tham chiếu không rõ ràng'''
+        if reference is None:
+            return []
+        positions = []
+        if reference.dieu:
+            for number in dict.fromkeys(reference.dieu):
+                positions.extend(self.dieu.get(number, []))
+        elif reference.muc is not None:
+            if reference.chuong is not None:
+                positions = self.muc.get((reference.chuong, reference.muc), [])
+            else:
+                # "Mục 2" mà không nói Chương nào -> chỉ tra được khi số Mục là duy nhất
+                matches = [key for key in self.muc if key[1] == reference.muc]
+                positions = self.muc[matches[0]] if len(matches) == 1 else []
+        elif reference.chuong is not None:
+            positions = self.chuong.get(reference.chuong, [])
+        return positions[:limit]
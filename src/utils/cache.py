@@ -0,0 +1,145 @@
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''chuẩn hoá câu hỏi làm key cache: NFC + gộp khoảng trắng'''
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', query)).strip()
+
+def query_key(query):
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+'''LRU cache trong bộ nhớ có TTL, đếm hit/miss'''
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (expire_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+'''cache embedding câu hỏi: LRU trong process, tuỳ chọn thêm Redis (lưu float32 bytes)'''
+class EmbeddingCache:
+    def __init__(self, maxsize=2048, ttl=86400, redis_client=None, namespace='embedding'):
+        self.local = TTLCache(maxsize, ttl)
+        self.redis = redis_client
+        self.prefix = f'emb:{namespace}:'
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self.single_flight = SingleFlight()     # router + retrieval cùng embed 1 câu hỏi mới -> chỉ chạy model 1 lần
+
+    def _redis_get(self, key):
+        try:
+            raw = self.redis.get(self.prefix + key)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Redis embedding cache lỗi: {str(e)}")
+            return None
+        if raw is None:
+            return None
+        self.redis_hits += 1
+        return np.frombuffer(raw, dtype=np.float32)
+
+    def _redis_set(self, key, embedding):
+        try:
+            self.redis.set(self.prefix + key, embedding.tobytes(), ex=int(self.local.ttl))
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Redis embedding cache lỗi: {str(e)}")
+
+    def get_or_compute(self, query, compute):
+        text = normalize_query(query)
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        embedding = self.local.get(key)
+        if embedding is not None:
+            return embedding
+        return self.single_flight.do(key, lambda: self._load(key, text, compute))
+
+    def _load(self, key, text, compute):
+        embedding = self.local.get(key)     # thread khác vừa tính xong
+        if embedding is not None:
+            return embedding
+        if self.redis is not None:
+            embedding = self._redis_get(key)
+        if embedding is None:
+            embedding = np.ascontiguousarray(compute(text), dtype=np.float32)
+            if self.redis is not None:
+                self._redis_set(key, embedding)
+
+        embedding.setflags(write=False)     # dùng chung giữa các request, không cho sửa
+        self.local.set(key, embedding)
+        return embedding
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update({'redis_hits': self.redis_hits, 'redis_errors': self.redis_errors})
+        return stats
+
+'''gộp các lời gọi đồng thời cùng key: chỉ 1 thread tính, các thread khác nhận chung kết quả'''
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
@@ -1,6 +1,7 @@
 import redis 
 import json 
 import os
+import uuid
 from datetime import datetime
 
 r = redis.Redis(host='localhost', port=6379, db=0)
@@ -8,16 +9,33 @@ r = redis.Redis(host='localhost', port=6379, db=0)
 # query cache 
 def query_cache(query, result, seconds = 3600):
     key = f'query:{query}'
-    value = json.dumps(result)
+    value = result if isinstance(result, bytes) else json.dumps(result)     # bytes: đã tự serialize
     r.set(key, value, ex = seconds)
 
-def get_cache(query):
+def get_cache(query, raw=False):
     key = f'query:{query}'
     cached = r.get(key)
     if cached: 
-        return json.loads(cached)
+        return cached if raw else json.loads(cached)
     return None
 
+# lock chống cache stampede giữa các process
+# mỗi lần giữ lock có token riêng: lock hết hạn rồi bị process khác lấy thì không xoá nhầm lock của họ
+_release_script = r.register_script(
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+def acquire_lock(name, seconds=30):
+    '''-> token nếu lấy được lock, None nếu process khác đang giữ'''
+    token = uuid.uuid4().hex
+    return token if r.set(f'lock:{name}', token, nx=True, ex=seconds) else None
+
+def release_lock(name, token):
+    return bool(_release_script(keys=[f'lock:{name}'], args=[token]))
+
+def is_locked(name):
+    return r.exists(f'lock:{name}') > 0
+
 ## chat history 
 def message_history(session_id, role, content):
     key = f'chat_history:{session_id}'
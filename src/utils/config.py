@@ -0,0 +1,106 @@
+import os
+
+'''cấu hình dùng chung, đọc từ biến môi trường'''
+
+# ------------ dữ liệu ------------
+INDEX_FILE = os.getenv('INDEX_FILE', 'src/database/faiss.index')
+CHUNK_FILE = os.getenv('CHUNK_FILE', 'data/Chunk.json')
+
+# ------------ faiss index ------------
+INDEX_TYPE = os.getenv('INDEX_TYPE', 'flat')                        # flat | ivf_flat | hnsw | ivf_pq | sq_fp16 | sq8 | opq_pq
+IVF_NLIST = int(os.getenv('IVF_NLIST', 0))                          # 0 -> tự chọn theo số vector
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 16))
+HNSW_M = int(os.getenv('HNSW_M', 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 200))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
+PQ_M = int(os.getenv('PQ_M', 64))                                   # số sub-quantizer, phải chia hết dimension
+PQ_NBITS = int(os.getenv('PQ_NBITS', 8))
+RESCORE_ENABLED = os.getenv('RESCORE_ENABLED', '1') == '1'       # index nén -> chấm lại top ứng viên bằng vector float32 (mmap)
+RESCORE_FACTOR = int(os.getenv('RESCORE_FACTOR', 4))              # lấy top_k * factor ứng viên từ index nén
+
+# ------------ cache ------------
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', 2048))
+EMBEDDING_CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', 86400))
+EMBEDDING_CACHE_REDIS = os.getenv('EMBEDDING_CACHE_REDIS', '1') == '1'   # dùng thêm Redis của chat_history
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', '1') == '1'      # cache kết quả retrieve() trong Redis
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 3600))
+RESULT_CACHE_LOCK_WAIT = float(os.getenv('RESULT_CACHE_LOCK_WAIT', 2))     # giây tối đa chờ process khác tính xong, quá thì tự tính
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))  # cosine tối thiểu để dùng lại câu trả lời
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 1000))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 86400))
+
+# ------------ models ------------
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'truro7/vn-law-embedding')
+RERANKER_MODEL_NAME = os.getenv('RERANKER_MODEL_NAME', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')      # torch | onnx (ONNX Runtime, int8)
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'models/onnx')        # model export ra đây, lần đầu dùng backend onnx
+ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', '1') == '1'            # quantize dynamic int8, 0 = onnx fp32
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+RERANKER_BACKEND = os.getenv('RERANKER_BACKEND', 'torch')        # torch | onnx (ONNX Runtime, int8)
+RERANKER_ONNX_BATCH = int(os.getenv('RERANKER_ONNX_BATCH', 16))    # batch cố định cho reranker onnx
+RERANKER_SEQ_BUCKETS = [int(x) for x in os.getenv('RERANKER_SEQ_BUCKETS', '128,256,512').split(',')]
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') == '1'      # load model trên thread nền ngay sau khi khởi động
+
+# ------------ rerank ------------
+RERANK_MAX_BATCH_SIZE = int(os.getenv('RERANK_MAX_BATCH_SIZE', 64))    # số cặp [query, chunk] tối đa / lần predict
+RERANK_MAX_WAIT_MS = float(os.getenv('RERANK_MAX_WAIT_MS', 5))         # thời gian chờ gom request
+PAIR_SCORE_CACHE_SIZE = int(os.getenv('PAIR_SCORE_CACHE_SIZE', 50000))  # cache điểm rerank (query, chunk)
+PAIR_SCORE_CACHE_TTL = int(os.getenv('PAIR_SCORE_CACHE_TTL', 86400))
+ADAPTIVE_RERANK_ENABLED = os.getenv('ADAPTIVE_RERANK_ENABLED', '1') == '1'   # 0 = rerank toàn bộ ứng viên như cũ
+RERANK_SKIP_MARGIN = float(os.getenv('RERANK_SKIP_MARGIN', 0.1))        # dense top-1 hơn top-2 >= margin -> bỏ qua cross-encoder
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', 5))                        # chỉ rerank N ứng viên đầu sau fuse
+RERANK_CASCADE_ENABLED = os.getenv('RERANK_CASCADE_ENABLED', '0') == '1'   # tắt mặc định, bật sau khi chỉnh margin theo audit
+RERANK_CASCADE_MARGIN = float(os.getenv('RERANK_CASCADE_MARGIN', 0.05))  # reranker nhẹ top-1 hơn top-2 < margin -> chấm thêm reranker nặng
+RERANKER_HEAVY_MODEL_NAME = os.getenv('RERANKER_HEAVY_MODEL_NAME', 'BAAI/bge-reranker-v2-m3')
+RERANK_AUDIT_RATE = float(os.getenv('RERANK_AUDIT_RATE', 0.02))         # tỉ lệ request chấm lại đầy đủ trên thread nền để đo độ khớp
+
+# ------------ hybrid bm25 ------------
+HYBRID_ENABLED = os.getenv('HYBRID_ENABLED', '1') == '1'      # gộp kết quả BM25 với faiss bằng RRF
+BM25_TOP_K = int(os.getenv('BM25_TOP_K', 10))                 # số chunk lấy từ BM25 trước khi fuse
+BM25_K1 = float(os.getenv('BM25_K1', 1.5))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+RRF_K = int(os.getenv('RRF_K', 60))
+
+STRUCTURE_LOOKUP_ENABLED = os.getenv('STRUCTURE_LOOKUP_ENABLED', '1') == '1'   # "Điều 98 nói gì" -> tra thẳng, bỏ qua embedding + rerank
+
+# ------------ ollama ------------
+OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', 120))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv('OLLAMA_MAX_CONNECTIONS', 20))
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')          # giữ model trong RAM giữa các request
+
+_STOP = ['Question:', 'Câu hỏi:', 'Human:', 'Assistant:']
+_SAMPLING = dict(top_k=10, top_p=0.9, repeat_penalty=1.1, num_ctx=4096)
+_CLIENT = dict(max_connections=OLLAMA_MAX_CONNECTIONS, keep_alive=OLLAMA_KEEP_ALIVE)
+
+# cấu hình từng client LLM, lấy qua src.models.ollama_client.get_llm(name)
+LLM_CONFIGS = {
+    # function calling
+    'router': dict(model=os.getenv('ROUTER_MODEL', 'llama3.1:8b'), temperature=0.1, stop=_STOP + ['```'],
+                   **_SAMPLING, **_CLIENT),
+    # trả lời theo context pháp luật (api, cli)
+    'answer': dict(model=os.getenv('ANSWER_MODEL', 'mistral:7b'), temperature=0.1, stop=_STOP,
+                   **_SAMPLING, **_CLIENT),
+    # giao diện chat gradio
+    'chat': dict(model=os.getenv('CHAT_MODEL', 'mistral:7b'), temperature=0.7, stop=_STOP,
+                 **_SAMPLING, **_CLIENT),
+}
+
+# ------------ prompt ------------
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 2000))        # token context luật trong prompt (num_ctx 4096)
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', 0.8)) # tỉ lệ 5-gram trùng -> coi là chunk trùng
+CONTEXT_MIN_TRIM_TOKENS = int(os.getenv('CONTEXT_MIN_TRIM_TOKENS', 64))    # phần ngân sách còn lại ít hơn -> không cắt thêm đoạn
+
+# ------------ api ------------
+API_MAX_CONCURRENCY = int(os.getenv('API_MAX_CONCURRENCY', 8))     # số request /ask xử lý cùng lúc
+API_MAX_QUEUE = int(os.getenv('API_MAX_QUEUE', 64))                # số request chờ tối đa, vượt -> 503
+API_MODEL_WORKERS = int(os.getenv('API_MODEL_WORKERS', 4))         # thread cho embedding / rerank
+
+# ------------ pipeline ------------
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 4))          # thread chạy retrieval song song với function calling
+
+# ------------ function calling ------------
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', '1') == '1'
+INTENT_NONE_THRESHOLD = float(os.getenv('INTENT_NONE_THRESHOLD', 0.5))   # similarity với mô tả tool, dưới ngưỡng -> không gọi LLM
+FC_HISTORY_TOKENS = int(os.getenv('FC_HISTORY_TOKENS', 512))          # ngân sách token cho lịch sử trong prompt function calling
+FC_MESSAGE_TOKENS = int(os.getenv('FC_MESSAGE_TOKENS', 160))          # mỗi tin nhắn cũ bị cắt còn tối đa chừng này token